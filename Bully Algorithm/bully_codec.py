@@ -0,0 +1,130 @@
+import functools
+import socket
+import struct
+
+MESSAGE_TYPES = {'ELECTION': 1, 'OK': 2, 'COORDINATOR': 3, 'HEARTBEAT': 4, 'SYNC': 5, 'DELTA': 6, 'LEADER_QUERY': 7,
+                 'LEADER': 8}
+MESSAGE_NAMES = {code: name for name, code in MESSAGE_TYPES.items()}
+FRAME_HEADER = struct.Struct('>IB')   # Length of the rest of the frame, message type
+PEER = struct.Struct('>hI4sH')        # Days to birthday, SU id, IPv4 address, port
+PID = struct.Struct('>hI')            # Days to birthday, SU id
+SENDER = struct.Struct('>IBhI4sHII')  # Frame header, sender peer record, sender membership version and term
+FLAG = struct.Struct('>?')            # ELECTION body: the receiver is the highest live peer and declares
+VERSION = struct.Struct('>I')         # SYNC body: membership version the changes are wanted since
+COUNT = struct.Struct('>II')          # DELTA body: number of added peer records and removed pids which follow
+LEADER = struct.Struct('>hI4sHI')     # LEADER body: peer record of the leader and the term it won, empty if unknown
+MAX_FRAME = 1 << 24                   # Longer frames mean the stream is corrupt
+
+ip_bytes = functools.lru_cache(maxsize=4096)(socket.inet_aton)
+ip_text = functools.lru_cache(maxsize=4096)(socket.inet_ntoa)
+
+
+def encode_peer(pid, address):
+    return PEER.pack(pid[0], pid[1], ip_bytes(address[0]), address[1])
+
+
+def encode(message_name, pid, address, version, term, body=b''):
+    """
+    Function to frame a message: length prefix, type byte, the sender as a fixed
+    12 byte (pid, listener address) record, its membership version and the biggest
+    election term it knows, then the body
+    @param body bytes of encode_flag, encode_sync, encode_delta or encode_leader, empty for the other messages
+    @return bytes
+    """
+    header = SENDER.pack(SENDER.size - 4 + len(body), MESSAGE_TYPES[message_name], pid[0], pid[1],
+                         ip_bytes(address[0]), address[1], version, term)
+    return header + body if body else header
+
+
+def encode_flag(flag):
+    return FLAG.pack(flag)
+
+
+def encode_sync(since):
+    return VERSION.pack(since)
+
+
+def encode_leader(pid, address, term):
+    return LEADER.pack(pid[0], pid[1], ip_bytes(address[0]), address[1], term)
+
+
+def encode_delta(added, removed):
+    """
+    @param added dictionary of pid -> listener address
+    @param removed iterable of pids
+    """
+    records = [COUNT.pack(len(added), len(removed))]
+    records.extend(encode_peer(pid, address) for pid, address in added.items())
+    records.extend(PID.pack(*pid) for pid in removed)
+    return b''.join(records)
+
+
+class stream_decoder(object):
+    """
+    Incremental decoder of the frames of one connection. Bytes are fed as they are
+    read; a frame split over several reads waits in the buffer until it is complete,
+    and several frames in one read all come out of the same feed
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """
+        Method to add received bytes and decode every complete frame
+        @return list of (message_name, (sender pid, sender listener address), sender membership version,
+        sender term, body),
+        body being the version of a SYNC, (added, removed) of a DELTA, the flag of an ELECTION (False if it has
+        none), (leader pid, leader listener address, term) of a LEADER (None if it has none) and None otherwise
+        @raises ValueError if the stream is corrupt
+        """
+        buffer = self.buffer
+        buffer += data
+        size = len(buffer)
+        messages = []
+        offset = 0
+        while size - offset >= SENDER.size:  # Every frame starts with the header and the sender
+            length, code, days_to_birthday, su_id, host, port, version, term = SENDER.unpack_from(buffer, offset)
+            name = MESSAGE_NAMES.get(code)
+            if name is None or not SENDER.size - 4 <= length <= MAX_FRAME:
+                raise ValueError("corrupt frame of type {} and length {}".format(code, length))
+            end = offset + 4 + length
+            if size < end:
+                break
+            body = None
+            if name == 'SYNC':
+                if end != offset + SENDER.size + VERSION.size:
+                    raise ValueError("SYNC of length {}".format(length))
+                body, = VERSION.unpack_from(buffer, offset + SENDER.size)
+            elif name == 'ELECTION':
+                body = end > offset + SENDER.size and FLAG.unpack_from(buffer, offset + SENDER.size)[0]
+            elif name == 'DELTA':
+                body = self.decode_delta(buffer, offset + SENDER.size, end)
+            elif name == 'LEADER' and end > offset + SENDER.size:
+                if end != offset + SENDER.size + LEADER.size:
+                    raise ValueError("LEADER of length {}".format(length))
+                leader = LEADER.unpack_from(buffer, offset + SENDER.size)
+                body = (leader[:2], (ip_text(leader[2]), leader[3]), leader[4])
+            messages.append((name, ((days_to_birthday, su_id), (ip_text(host), port)), version, term, body))
+            offset = end
+        if offset:
+            del buffer[:offset]
+        return messages
+
+    def decode_delta(self, buffer, offset, end):
+        """
+        @return (dictionary of added pid -> listener address, list of removed pids) of the records from offset to end
+        """
+        if end - offset < COUNT.size:
+            raise ValueError("DELTA without counts")
+        adds, removes = COUNT.unpack_from(buffer, offset)
+        offset += COUNT.size
+        middle = offset + adds * PEER.size
+        if middle + removes * PID.size != end:
+            raise ValueError("{} adds and {} removes do not match the frame length".format(adds, removes))
+        view = memoryview(buffer)
+        added = {(days_to_birthday, su_id): (ip_text(host), port)
+                 for days_to_birthday, su_id, host, port in PEER.iter_unpack(view[offset:middle])}
+        removed = list(PID.iter_unpack(view[middle:end]))
+        view.release()
+        return added, removed
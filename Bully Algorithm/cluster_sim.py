@@ -0,0 +1,310 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import socketserver
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+from gcd2_Lab2 import GroupCoordinatorDaemon
+from lab2 import lab2, ELECTION_MODES, ASSUME_FAILURE_TIMEOUT, HEARTBEAT_INTERVAL
+
+SIZES = [3, 10, 50, 100, 200, 500]     # Number of group members
+SCENARIOS = ['crash', 'pause', 'partition', 'join']
+REPEATS = 3                            # Groups started per case
+SETTLE_TIMEOUT = 30.0                  # Seconds a group gets to agree on a leader, longer counts as failed
+PAUSE = 10 * HEARTBEAT_INTERVAL        # Seconds a paused leader is silent, several times its detection time
+SETTLED = 2 * ASSUME_FAILURE_TIMEOUT   # Seconds a group runs before a member joins, its leader declared long ago
+REGRESSION = 1.10                      # Median ratio reported as a regression by --compare
+
+
+class sim_node(lab2):
+    """
+    Group member driven by the simulator instead of its own run loop. It can crash,
+    which closes its sockets like the end of a process, pause, which leaves them open
+    and unread like a stopped process, and drop every message from the pids on the
+    other side of a partition
+    """
+
+    def __init__(self, gcd_address, next_birthday, su_id, election_mode):
+        super().__init__(gcd_address, next_birthday, su_id, election_mode)
+        self.crashed = False
+        self.paused_until = 0.0  # time.monotonic() the node answers again after
+        self.blocked = set()     # Pids whose messages are dropped
+
+    def handle_message(self, peer, recvDict):
+        if recvDict[1][0] not in self.blocked:
+            super().handle_message(peer, recvDict)
+
+    def step(self):
+        if not self.crashed and time.monotonic() >= self.paused_until:
+            self.poll(0)
+
+    def crash(self):
+        if not self.crashed:
+            self.crashed = True
+            self.pool.close()
+            self.selector.unregister(self.listener)
+            self.listener.close()
+            self.selector.close()
+
+
+class cluster(object):
+    """
+    A GCD and a group of sim_node members in this process. Every member gets a
+    random birthday and SU id, so the pids do not join in order
+    """
+
+    def __init__(self, size, election_mode, seed=None):
+        for group in (GroupCoordinatorDaemon.listeners_by_pid, GroupCoordinatorDaemon.pids_by_listener,
+                      GroupCoordinatorDaemon.pids_by_student):
+            group.clear()  # The GCD keeps its group in class attributes
+        self.gcd = socketserver.ThreadingTCPServer(('localhost', 0), GroupCoordinatorDaemon)
+        self.gcd.daemon_threads = True
+        threading.Thread(target=self.gcd.serve_forever, daemon=True).start()
+        rand = random.Random(seed)
+        now = datetime.now()
+        self.nodes = [sim_node(self.gcd.server_address, now + timedelta(days=rand.randint(1, 364), hours=1), su_id,
+                               election_mode)
+                      for su_id in rand.sample(range(1_000_000, 10_000_000), size)]
+        self.rand = rand
+        self.election_mode = election_mode
+
+    def live(self):
+        return [node for node in self.nodes if not node.crashed]
+
+    def sent(self):
+        return sum(node.sent for node in self.nodes)
+
+    def start(self):
+        """
+        Method to join every member, then start all their elections at once
+        @return (seconds until every member knows the biggest pid is the leader, messages sent), (None, ...) if not
+        """
+        for node in self.nodes:
+            node.update_members(node.join_group())
+        sent = self.sent()
+        started = time.monotonic()
+        for node in self.nodes:
+            node.start_election('JOIN')
+        leader = max(node.pid for node in self.nodes)
+        return self.run_until([(self.nodes, leader)], started), self.sent() - sent
+
+    def run_until(self, groups, started, timeout=SETTLE_TIMEOUT):
+        """
+        Method to step every member until the members of every group follow its leader
+        @param groups list of (members, pid of the leader they should follow)
+        @return seconds from started, None if the timeout passed first
+        """
+        while time.monotonic() - started < timeout:
+            for node in self.nodes:
+                node.step()
+            if all(node.bully == leader for members, leader in groups for node in members if not node.crashed):
+                return time.monotonic() - started
+        return None
+
+    def crash_leader(self):
+        """
+        Scenario: the leader crashes
+        @return seconds until the others follow the next biggest pid
+        """
+        leader = max(self.live(), key=lambda node: node.pid)
+        started = time.monotonic()
+        leader.crash()
+        live = self.live()
+        return self.run_until([(live, max(node.pid for node in live))], started)
+
+    def pause_leader(self, pause=PAUSE):
+        """
+        Scenario: the leader stops answering for a while without closing its connections
+        @return seconds until the others follow the next biggest pid
+        """
+        leader = max(self.live(), key=lambda node: node.pid)
+        started = time.monotonic()
+        leader.paused_until = started + pause
+        others = [node for node in self.live() if node is not leader]
+        return self.run_until([(others, max(node.pid for node in others))], started)
+
+    def partition(self):
+        """
+        Scenario: the group splits in two halves which drop each other's messages
+        @return seconds until the members of each half follow the biggest pid of their half
+        """
+        live = self.live()
+        self.rand.shuffle(live)
+        halves = [live[:len(live) // 2], live[len(live) // 2:]]
+        started = time.monotonic()
+        for half, other in zip(halves, reversed(halves)):
+            blocked = {node.pid for node in other}
+            for node in half:
+                node.blocked = blocked
+        groups = [(half, max(node.pid for node in half)) for half in halves if half]
+        return self.run_until(groups, started)
+
+    def settle(self, seconds=SETTLED):
+        """
+        Method to step every member for a while, until the membership changes went round
+        """
+        until = time.monotonic() + seconds
+        while time.monotonic() < until:
+            for node in self.nodes:
+                node.step()
+
+    def join(self):
+        """
+        Scenario: a new member joins the group and asks who the leader is
+        @return seconds until every member follows the biggest pid
+        """
+        started = time.monotonic()
+        birthday = datetime.now() + timedelta(days=self.rand.randint(1, 364), hours=1)
+        node = sim_node(self.gcd.server_address, birthday, self.rand.randrange(1_000_000, 10_000_000),
+                        self.election_mode)
+        self.nodes.append(node)
+        node.update_members(node.join_group())
+        node.discover_leader()
+        live = self.live()
+        return self.run_until([(live, max(node.pid for node in live))], started)
+
+    def close(self):
+        for node in self.nodes:
+            node.crash()
+        self.gcd.shutdown()
+        self.gcd.server_close()
+
+
+def percentile(values, share):
+    """
+    Function to read a percentile of sorted values, nearest rank
+    """
+    return values[min(len(values) - 1, max(0, math.ceil(share * len(values)) - 1))]
+
+
+def descriptors_needed(size, election_mode):
+    """
+    Function to estimate the file descriptors of a group in this process, both ends of
+    every connection included. A bully election opens connections between most pairs
+    """
+    connections = size * size if election_mode == 'bully' else 4 * size
+    return 2 * connections + size + 64
+
+
+def run_case(size, election_mode, scenario, repeats, seed):
+    """
+    Function to start a group repeatedly and measure one scenario on it
+    @return dictionary of the measurements, times in milliseconds
+    """
+    leader_times, leader_messages, failover_times, failover_messages = [], [], [], []
+    failed = 0
+    for repeat in range(repeats):
+        group = cluster(size, election_mode, None if seed is None else seed + repeat)
+        failover = None
+        try:
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):  # lab2 prints every message
+                elapsed, messages = group.start()
+                if elapsed is not None:
+                    if scenario == 'join':
+                        group.settle()  # A member joins a group whose leader declared long ago
+                    sent = group.sent()
+                    failover = {'crash': group.crash_leader, 'pause': group.pause_leader,
+                                'partition': group.partition, 'join': group.join}[scenario]()
+        finally:
+            group.close()
+        if elapsed is None or failover is None:
+            failed += 1
+            continue
+        leader_times.append(1000 * elapsed)
+        leader_messages.append(messages)
+        failover_times.append(1000 * failover)
+        failover_messages.append(group.sent() - sent)
+    result = {'mode': election_mode, 'nodes': size, 'scenario': scenario, 'runs': repeats, 'failed': failed}
+    for name, values in (('leader_ms', leader_times), ('leader_messages', leader_messages),
+                         ('failover_ms', failover_times), ('failover_messages', failover_messages)):
+        values.sort()
+        result[name + '_p50'] = round(percentile(values, 0.50), 3) if values else None
+        result[name + '_max'] = round(values[-1], 3) if values else None
+    return result
+
+
+def run(sizes, modes, scenarios, repeats=REPEATS, seed=0):
+    """
+    Function to run every scenario in every election mode for every group size
+    @return list of result dictionaries, one per case
+    """
+    limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    results = []
+    for size in sizes:
+        for election_mode in modes:
+            if descriptors_needed(size, election_mode) > limit:
+                print("{:>8} {:>4} nodes skipped, needs more than {} file descriptors".format(election_mode, size, limit))
+                continue
+            for scenario in scenarios:
+                result = run_case(size, election_mode, scenario, repeats, seed)
+                print("{mode:>8} {nodes:>4} nodes {scenario:<9} leader {leader_ms_p50!s:>9} ms "
+                      "{leader_messages_p50!s:>6} msgs  failover {failover_ms_p50!s:>9} ms "
+                      "{failover_messages_p50!s:>6} msgs  failed {failed}".format(**result))
+                results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION):
+    """
+    Function to print the median times to a leader and failover times against a saved run
+    @return number of cases slower than the baseline by more than the threshold, or failing more often
+    """
+    def key(result):
+        return result['mode'], result['nodes'], result['scenario']
+
+    previous = {key(result): result for result in baseline['results']}
+    regressions = 0
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+        flags = []
+        if result['failed'] > old['failed']:
+            flags.append('FAILED {}'.format(result['failed']))
+        ratios = []
+        for name in ('leader_ms_p50', 'failover_ms_p50'):
+            if result[name] is not None and old[name]:
+                ratio = result[name] / old[name]
+                ratios.append('{} x{:.2f}'.format(name, ratio))
+                if ratio > threshold:
+                    flags.append('REGRESSION')
+        regressions += bool(flags)
+        print("{:>8} {:>4} nodes {:<9} {}  {}".format(*key(result), '  '.join(ratios), ' '.join(sorted(set(flags)))))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Election benchmark of lab2 groups simulated in this process")
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--modes', nargs='+', choices=ELECTION_MODES, default=list(ELECTION_MODES))
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='election_results.json', help="JSON file the results are saved to")
+    parser.add_argument('--compare', help="JSON file of an earlier run to compare against")
+    args = parser.parse_args()
+    results = run(args.sizes, args.modes, args.scenarios, args.repeats, args.seed)
+    report = {
+        'created': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=1)
+    print("Saved {} results to {}".format(len(results), args.output))
+    if args.compare:
+        with open(args.compare) as baseline:
+            if compare(results, json.load(baseline)):
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
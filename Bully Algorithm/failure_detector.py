@@ -0,0 +1,120 @@
+import math
+import time
+from collections import deque
+
+PHI_THRESHOLD = 8.0         # Suspicion level above which a peer is suspected, 8 is about one mistake in 10^8
+HEARTBEAT_WINDOW = 100      # Arrival intervals kept per peer
+MIN_STD_DEVIATION = 0.1     # Seconds, keeps a very regular peer from being suspected for a small delay
+
+
+class failure_detector(object):
+    """
+    Phi accrual failure detector. The intervals between the heartbeats of every
+    watched peer are kept, and phi is how unlikely it is, given their mean and
+    standard deviation, that the next heartbeat is still on its way after the time
+    since the last one. Peers whose phi goes over the threshold are reported to
+    on_suspect, suspected peers which send a heartbeat again to on_alive.
+
+    Any message from a peer counts as a heartbeat. A heartbeat which ends a
+    suspicion starts the arrival history over rather than adding the long gap.
+    """
+
+    def __init__(self, interval, on_suspect, on_alive, threshold=PHI_THRESHOLD, window=HEARTBEAT_WINDOW,
+                 min_std_deviation=MIN_STD_DEVIATION):
+        self.interval = interval    # Expected seconds between heartbeats, the history of a new peer
+        self.on_suspect = on_suspect
+        self.on_alive = on_alive
+        self.threshold = threshold
+        self.window = window
+        self.min_std_deviation = min_std_deviation
+        self.last = {}              # Pid -> time.monotonic() of its last heartbeat
+        self.intervals = {}         # Pid -> deque of the last arrival intervals
+        self.sums = {}              # Pid -> (sum, sum of squares) of its intervals
+        self.watched = set()        # Pids checked by check
+        self.suspected = set()
+
+    def heartbeat(self, pid, now=None):
+        """
+        Method to record a heartbeat, or any other message, from a peer
+        """
+        now = time.monotonic() if now is None else now
+        last = self.last.get(pid)
+        self.last[pid] = now
+        if pid in self.suspected:
+            self.suspected.discard(pid)
+            self.reset(pid)
+            self.on_alive(pid)
+        elif last is not None:
+            self.add_interval(pid, now - last)
+
+    def add_interval(self, pid, interval):
+        intervals = self.intervals.get(pid)
+        if intervals is None:
+            self.reset(pid)
+            intervals = self.intervals[pid]
+        total, squares = self.sums[pid]
+        if len(intervals) == self.window:
+            oldest = intervals.popleft()
+            total -= oldest
+            squares -= oldest * oldest
+        intervals.append(interval)
+        self.sums[pid] = (total + interval, squares + interval * interval)
+
+    def reset(self, pid):
+        """
+        Method to forget the arrival history of a peer, it starts over from the expected interval
+        """
+        self.intervals[pid] = deque([self.interval])
+        self.sums[pid] = (self.interval, self.interval * self.interval)
+
+    def phi(self, pid, now=None):
+        """
+        Method to work out the suspicion level of a peer, with the logistic approximation
+        of the normal distribution of its arrival intervals
+        """
+        now = time.monotonic() if now is None else now
+        if pid not in self.intervals:
+            self.reset(pid)
+        count = len(self.intervals[pid])
+        total, squares = self.sums[pid]
+        mean = total / count
+        std_deviation = max(self.min_std_deviation, math.sqrt(max(0.0, squares / count - mean * mean)))
+        y = (now - self.last.get(pid, now) - mean) / std_deviation
+        exponent = -y * (1.5976 + 0.070566 * y * y)
+        if exponent > 700:  # Long before the heartbeat is due
+            return 0.0
+        e = math.exp(exponent)
+        if e == 0.0:  # Long after
+            return math.inf
+        if y > 0:
+            return -math.log10(e / (1.0 + e))
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+    def watch(self, pids, now=None):
+        """
+        Method to change the watched peers. A newly watched peer counts from now, so the
+        time it was not watched does not make it suspected
+        """
+        now = time.monotonic() if now is None else now
+        pids = set(pids)
+        for pid in pids - self.watched:
+            self.last[pid] = now
+        for pid in self.watched - pids:
+            self.suspected.discard(pid)
+        self.watched = pids
+
+    def check(self, now=None):
+        """
+        Method to report the watched peers which became suspected
+        """
+        now = time.monotonic() if now is None else now
+        for pid in [pid for pid in self.watched if pid not in self.suspected]:
+            if self.phi(pid, now) > self.threshold:
+                self.suspected.add(pid)
+                self.on_suspect(pid)
+
+    def forget(self, pid):
+        for table in (self.last, self.intervals, self.sums):
+            table.pop(pid, None)
+        self.watched.discard(pid)
+        self.suspected.discard(pid)
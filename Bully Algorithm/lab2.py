@@ -8,10 +8,26 @@ import pickle
 import selectors
 import enum
 import time
+from collections import deque
+
+from bully_codec import encode, encode_delta, encode_flag, encode_leader, encode_sync
+from failure_detector import failure_detector
+from peer_pool import peer_pool
+from timer_heap import timer_heap
 
 CHECK_INTERVAL = 2.0
 PEER_DIGITS = 100
 ASSUME_FAILURE_TIMEOUT = 2.0
+VICTOR_TIMEOUT = 2 * ASSUME_FAILURE_TIMEOUT  # Longer, the peer which sent OK runs its own election first
+HEARTBEAT_INTERVAL = 0.5  # Seconds between the heartbeats of the bully and its members
+FAILURE_CHECK_INTERVAL = HEARTBEAT_INTERVAL / 4  # Seconds between looks at the suspicion level of the watched peers
+BUF_SZ = 4096
+LISTEN_BACKLOG = socket.SOMAXCONN  # A new leader is connected to by the whole group at once
+ELECTION_MODES = ('bully', 'modified')
+ELECTION_MODE = 'bully'  # 'bully' sends ELECTION to every bigger pid, 'modified' only to the biggest live one
+ELECTION_HISTORY = 100  # Elections kept with their latency and message count
+LEADER_QUERIES = 3  # Biggest members a joining member asks who the leader is
+MEMBERSHIP_LOG = 4096  # Membership changes kept for deltas, older versions get the whole membership
 
 
 class State(enum.Enum):
@@ -24,47 +40,81 @@ class State(enum.Enum):
     SEND_ELECTION = 'ELECTION'
     SEND_VICTORY = 'COORDINATOR'
     SEND_OK = 'OK'
-    SEND_PROBE = 'NONE'
+    SEND_HEARTBEAT = 'HEARTBEAT'
+    SEND_SYNC = 'SYNC'
+    SEND_DELTA = 'DELTA'
+    SEND_LEADER_QUERY = 'LEADER_QUERY'
+    SEND_LEADER = 'LEADER'
 
     # Incoming message is pending
     WAITING_FOR_OK = 'WAIT_OK'  # When I've sent them an ELECTION message
     WAITING_FOR_VICTOR = 'WHO IS THE WINNER?'  # This one only applies to myself
+    WAITING_FOR_LEADER = 'WHO IS THE LEADER?'  # Myself, after LEADER_QUERY on join
     WAITING_FOR_ANY_MESSAGE = 'WAITING'  # When I've done an accept on their connect to my server
 
 
 class lab2:
 
-    def __init__(self, gcd_address, next_birthday, su_id):
+    def __init__(self, gcd_address, next_birthday, su_id, election_mode=ELECTION_MODE):
+        if election_mode not in ELECTION_MODES:
+            raise ValueError("election mode must be one of {}".format(', '.join(ELECTION_MODES)))
         self.gcd_address = (gcd_address[0], int(gcd_address[1]))
         days_to_birthday = (next_birthday - datetime.now()).days
         self.pid = (days_to_birthday, int(su_id))
         self.bully = None
+        self.term = 0          # Biggest election term seen, every declared victory starts a bigger one
+        self.leader_term = 0   # Term of the COORDINATOR of the bully
+        self.declared = 0.0    # time.monotonic() of my last victory
         self.members = {}
-        self.states = {}
+        self.version = 0       # Membership version, one more for every add or remove
+        self.changes = deque(maxlen=MEMBERSHIP_LOG)  # (version, pid, listener address or None if removed)
+        self.peer_versions = {}  # Peer pid -> its membership version we are up to date with
+        self.syncing = set()   # Peer pids a SYNC was sent to and no DELTA came back yet
+        self.queried = set()   # Member pids a LEADER_QUERY was sent to and no LEADER came back yet
+        self.removed = set()   # Pids I removed as failed, only a message from them brings them back
+        self.states = {}       # Peer pid (or None for myself) -> State
+        self.deadlines = {}    # Peer pid (or None for myself) -> timer id of the deadline of its state
+        self.election_mode = election_mode
+        self.candidates = []   # Bigger pids a modified election did not send ELECTION to yet, biggest last
+        self.sent = 0          # Messages sent, heartbeats aside
+        self.election_start = None  # (reason, time.monotonic(), self.sent) of the election in progress
+        self.elections = deque(maxlen=ELECTION_HISTORY)  # (reason, seconds to a leader, messages sent)
         self.selector = selectors.DefaultSelector()
+        self.timers = timer_heap()
+        self.pool = peer_pool(self.selector, self.peer_failed)
+        self.detector = failure_detector(HEARTBEAT_INTERVAL, self.suspect, self.alive)
+        self.timers.schedule(HEARTBEAT_INTERVAL, self.send_heartbeats)
+        self.timers.schedule(FAILURE_CHECK_INTERVAL, self.check_failures)
         self.listener, self.listener_addr = self.start_a_server()
 
     def run(self):
         """
-        Function to poll the sockets
+        Function to poll the sockets. The selector wakes up for the next deadline at the latest
         """
-        # self.selector.register(self.listener, selectors.EVENT_READ, data = None)
         while True:
-            events = self.selector.select(CHECK_INTERVAL)
-            for key, mask in events:
-                if key.fileobj == self.listener:
-                    self.accept_peer()
-                elif mask & selectors.EVENT_READ:
-                    self.receive_message(key.fileobj)
-                else:
-                    self.send_message(key.fileobj)
-            self.check_timeouts()
+            self.poll(CHECK_INTERVAL)
+
+    def poll(self, longest):
+        """
+        Method to handle the socket events of one select, waiting longest seconds at most, then the deadlines
+        """
+        events = self.selector.select(self.timers.timeout(longest))
+        for key, mask in events:
+            if key.fileobj == self.listener:
+                self.accept_peer()
+                continue
+            if mask & selectors.EVENT_WRITE:
+                self.pool.writable(key.fileobj)
+            if mask & selectors.EVENT_READ and key.fileobj in self.pool:
+                self.receive_message(key.fileobj)
+        self.check_timeouts()
 
     def check_timeouts(self):
         """
-        Function to check the socket timeouts
+        Function to handle the deadlines which have passed and close idle connections
         """
-        self.listener.settimeout(ASSUME_FAILURE_TIMEOUT)
+        self.timers.run_due()
+        self.pool.evict_idle()
 
     def start_a_server(self):
         """
@@ -72,7 +122,7 @@ class lab2:
         """
         listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         listener.bind(('localhost', 0))
-        listener.listen(5)
+        listener.listen(LISTEN_BACKLOG)
         listener.setblocking(False)
         self.selector.register(listener, selectors.EVENT_READ, data=None)
         listener_addr = listener.getsockname()
@@ -80,12 +130,15 @@ class lab2:
 
     def accept_peer(self):
         """
-        Method to accept connection
+        Method to accept every pending connection
         """
-        conn, addr = self.listener.accept()  # Should be ready
-        print('accepted connection from', addr)
-        conn.setblocking(False)
-        self.selector.register(conn, selectors.EVENT_READ, data=None)
+        while True:
+            try:
+                conn, addr = self.listener.accept()
+            except BlockingIOError:
+                return
+            print('accepted connection from', addr)
+            self.pool.add(conn)
 
     def join_group(self):
         """
@@ -94,13 +147,18 @@ class lab2:
         recvList = []
         try:
             print("Entered connect_GCD")
-            s = self.get_connection(self.gcd_address)
-            print("Got connection")
-            message_name = 'JOIN'
-            print(self.listener_addr)
-            message_data = (self.pid, self.listener_addr)
-            self.send(s, message_name, message_data, True)
-            recvData = s.recv(4098)
+            with socket.create_connection(self.gcd_address) as s:  # The GCD answers one message per connection
+                print("Got connection")
+                message_name = 'JOIN'
+                print(self.listener_addr)
+                message_data = (self.pid, self.listener_addr)
+                s.sendall(pickle.dumps((message_name, message_data)))
+                recvData = b''
+                while True:  # The reply outgrows one read for big groups, the GCD closes once it is sent
+                    chunk = s.recv(BUF_SZ)
+                    if not chunk:
+                        break
+                    recvData += chunk
             recvList = pickle.loads(recvData)
             print("GCD sent: ", recvList)
         except (socket.error, socket.timeout) as err:
@@ -109,182 +167,447 @@ class lab2:
 
     def start_election(self, message):
         """
-        Election Algorithm
-        """
-        i_am_biggest_bully = True
-        if message:
-            my_daysToBday, my_suid = self.pid
-            self.states[self.listener] = 'ELECTION_IN_PROGRESS'
-            for peer_pid, peer_addr in self.members.items():
-                peer_daysToBday, peer_suid = peer_pid
-                if peer_daysToBday > my_daysToBday:
-                    i_am_biggest_bully = False
-                    peer = self.get_connection(peer_addr)
-                    self.states[peer] = State.SEND_ELECTION
-                    self.send_message(peer)
-                elif peer_daysToBday == my_daysToBday:
-                    if peer_suid > my_suid:
-                        i_am_biggest_bully = False
-                        peer = self.get_connection(peer_addr)
-                        self.states[peer] = State.SEND_ELECTION
-                        self.send_message(peer)
-                else:
-                    i_am_biggest_bully = True
-                    message = "I am the highest priority process"
+        Election Algorithm. In bully mode ELECTION goes to every member with a bigger pid;
+        if none of them answers OK within ASSUME_FAILURE_TIMEOUT I am the biggest bully.
+        In modified mode it goes to the biggest of them only, flagged so that it declares
+        victory right away, and to the next biggest if it does not answer
+        """
+        if self.is_election_in_progress():
+            return
+        print("Starting election as {} [{}]".format(message, self.pr_now()))
+        self.begin_election(message)
+        higher = sorted(pid for pid in self.members if pid > self.pid)
+        if not higher:
+            self.declare_victory("I am the highest priority process")
+            return
+        self.set_state(State.WAITING_FOR_OK)
+        if self.election_mode == 'modified':
+            self.candidates = higher
+            self.elect_next_candidate()
+            return
+        for peer_pid in higher:
+            self.send_to(peer_pid, self.members[peer_pid], State.SEND_ELECTION)
+        self.check_election()
+
+    def elect_next_candidate(self):
+        """
+        Method to send the flagged ELECTION of a modified election to the biggest candidate still a member
+        """
+        while self.candidates:
+            peer_pid = self.candidates.pop()
+            if peer_pid in self.members:
+                self.send_to(peer_pid, self.members[peer_pid], State.SEND_ELECTION, encode_flag(True))
+                return
+        self.check_election()
+
+    def check_election(self):
+        """
+        Method to declare victory once every peer sent ELECTION failed to answer. A modified
+        election steps down to the next candidate first
+        """
+        if self.get_state() != State.WAITING_FOR_OK:
+            return
+        if not any(peer is not None and state == State.WAITING_FOR_OK for peer, state in self.states.items()):
+            if self.candidates:
+                self.elect_next_candidate()
+            else:
+                self.declare_victory('OK not received')
+
+    def discover_leader(self):
+        """
+        Join path: ask the biggest members who the leader is instead of starting an election.
+        Only a leader I outrank, or no leader known within ASSUME_FAILURE_TIMEOUT, is elected.
+        A leader which does not answer is suspected by my failure detector
+        """
+        queried = sorted((pid for pid in self.members if pid != self.pid), reverse=True)[:LEADER_QUERIES]
+        if not queried or queried[0] < self.pid:
+            self.start_election('JOIN')  # I outrank every member and so the leader
+            return
+        print("Asking {} for the leader [{}]".format(queried, self.pr_now()))
+        self.queried = set(queried)
+        self.set_state(State.WAITING_FOR_LEADER, None, ASSUME_FAILURE_TIMEOUT, self.leader_timeout)
+        for pid in queried:
+            self.send_to(pid, self.members[pid], State.SEND_LEADER_QUERY)
+
+    def leader_answer(self, peer_pid, leader=None):
+        """
+        Method to act on the LEADER from a member I asked, leader None if it knows none or failed
+        @param leader (pid, listener address, term) of the leader
+        """
+        if self.get_state() != State.WAITING_FOR_LEADER or peer_pid not in self.queried:
+            return
+        self.queried.discard(peer_pid)
+        if leader is None:
+            if not self.queried:
+                self.set_quiescent()
+                self.start_election('JOIN, no leader known')
+            return
+        leader_pid, leader_addr, term = leader
+        self.set_quiescent()
+        self.queried = set()
+        if leader_pid < self.pid:
+            self.start_election('JOIN, I outrank {}'.format(leader_pid))
+            return
+        self.add_member(leader_pid, leader_addr)
+        self.set_leader(leader_pid)
+        self.leader_term = term
+        print("The Leader is: {} as {} told [{}]".format(self.pr_leader(), peer_pid, self.pr_now()))
+
+    def leader_timeout(self):
+        """
+        Deadline of WAITING_FOR_LEADER: no member I asked knows a leader, elect one
+        """
+        if self.get_state() == State.WAITING_FOR_LEADER:
+            self.set_quiescent()
+            self.queried = set()
+            self.start_election('JOIN, LEADER not received')
 
-                if self.states[self.listener] == State.QUIESCENT:
-                    i_am_biggest_bully = False
-                    break
-                else:
-                    i_am_biggest_bully = True
-                    message = 'OK not received'
-        if i_am_biggest_bully:
+    def begin_election(self, reason):
+        """
+        Method to start counting the time and messages of an election, unless one is counted already
+        """
+        if self.election_start is None:
+            self.election_start = (reason, time.monotonic(), self.sent)
+
+    def end_election(self):
+        """
+        Method to record the time and messages of the election which just got a leader
+        """
+        if self.election_start is None:
+            return
+        reason, started, sent = self.election_start
+        self.election_start = None
+        self.elections.append((reason, time.monotonic() - started, self.sent - sent))
+        print("Election as {} took {:.1f} ms and {} messages [{}]".format(
+            reason, 1000 * self.elections[-1][1], self.elections[-1][2], self.pr_now()))
+
+    def ok_timeout(self, peer_pid):
+        """
+        Deadline of an ELECTION: the peer is assumed to have failed
+        """
+        if self.get_state(peer_pid) == State.WAITING_FOR_OK:
+            self.set_quiescent(peer_pid)
+            self.remove_member(peer_pid)
+            self.check_election()
+
+    def victor_timeout(self):
+        """
+        Deadline of WAITING_FOR_VICTOR: the peer which sent OK never declared, start over
+        """
+        if self.get_state() == State.WAITING_FOR_VICTOR:
             self.set_quiescent()
-            self.bully = self.pid
-            self.declare_victory(message)
+            self.start_election('COORDINATOR not received')
 
     def update_members(self, recvMemberList):
         """
         Function to update the member list
         """
-        print("Items are:", recvMemberList.items())
         for key, value in recvMemberList.items():
-            self.members[key] = value
+            self.add_member(key, tuple(value))
 
-    def send_message(self, peer):
+    def add_member(self, pid, addr):
         """
-        Function to send message based on the State
+        Method to add a member or change its address, a new membership version if it did
         """
-        state = self.get_state(peer)
-        try:
+        if self.members.get(pid) != addr:
+            self.members[pid] = addr
+            self.record_change(pid, addr)
+
+    def remove_member(self, pid):
+        """
+        Method to drop a failed member, a new membership version if it was one. Its
+        heartbeat history goes too, should it come back it starts over. An ELECTION
+        waiting for its OK times out right away
+        """
+        if self.get_state(pid) == State.WAITING_FOR_OK:
+            self.set_state(State.WAITING_FOR_OK, pid, 0, self.ok_timeout, pid)
+        if pid != self.pid and self.members.pop(pid, None) is not None:
+            self.removed.add(pid)
+            self.peer_versions.pop(pid, None)
+            self.syncing.discard(pid)
+            self.detector.forget(pid)
+            self.record_change(pid, None)
+
+    def record_change(self, pid, addr):
+        self.version += 1
+        self.changes.append((self.version, pid, addr))
 
+    def members_since(self, since):
+        """
+        Method to collapse the membership changes after a version into the adds and removes
+        of a DELTA. A version older than the log, or newer than mine from a previous run of
+        this process, gets the whole membership and every member I removed as failed
+        @return (dictionary of added pid -> listener address, list of removed pids)
+        """
+        if since == 0 or since > self.version or (self.changes and since < self.changes[0][0] - 1):
+            return dict(self.members), list(self.removed)
+        added = {}
+        removed = set()
+        for version, pid, addr in reversed(self.changes):
+            if version <= since:
+                break
+            if pid not in added and pid not in removed:  # Only the newest change of a member counts
+                if addr is None:
+                    removed.add(pid)
+                else:
+                    added[pid] = addr
+        return added, list(removed)
+
+    def apply_delta(self, peer_pid, version, added, removed):
+        """
+        Method to merge a DELTA from a peer, which makes us up to date with its version.
+        Members I removed as failed stay removed, the peer may not have noticed yet. The ones
+        it removed count as failed, except my bully, which my failure detector watches.
+        A new member bigger than the bully, or than me if there is none, is elected
+        """
+        bigger = None
+        for pid, addr in added.items():
+            if pid in self.removed:
+                continue
+            if pid not in self.members and pid > max(self.pid, self.bully or self.pid):
+                bigger = pid
+            self.add_member(pid, addr)
+        for pid in removed:
+            if pid == peer_pid or pid not in self.members:
+                continue
+            if self.get_state(pid) == State.WAITING_FOR_OK:
+                self.set_state(State.WAITING_FOR_OK, pid, 0, self.ok_timeout, pid)
+            elif pid != self.bully:  # The peer may be wrong about my bully, its heartbeats tell
+                self.remove_member(pid)
+        self.peer_versions[peer_pid] = version
+        self.syncing.discard(peer_pid)
+        if bigger is not None:
+            self.clear_election()
+            self.start_election('{} joined'.format(bigger))
+
+    def check_version(self, peer, peer_pid, version):
+        """
+        Method to ask a peer for its membership changes when its version is not the one we have
+        """
+        if version != self.peer_versions.get(peer_pid, 0) and peer_pid not in self.syncing:
+            self.syncing.add(peer_pid)
+            self.send_message(peer, State.SEND_SYNC, encode_sync(self.peer_versions.get(peer_pid, 0)))
+
+    def send_message(self, peer, state, body=b''):
+        """
+        Function to send the message of a state
+        @return True if the message was queued
+        """
+        heartbeat = state == State.SEND_HEARTBEAT  # Too many to print or count with the election messages
+        if not heartbeat:
             print('{}: sending {} [{}]'.format(self.pr_sock(peer), state, self.pr_now()))
-            try:
-                self.send(peer, state.value, self.members)
-            except ConnectionError as err:
-                print("Connection error %s" % err)
-        except Exception as err:
-            print("Socket creation failed %s" % err)
+        try:
+            self.send(peer, state.value, body)
+            self.sent += not heartbeat
+        except OSError as err:
+            print("Connection error %s" % err)
+            self.pool.discard(peer)
+            return False
+        return True
+
+    def send_to(self, peer_pid, member, state, body=b''):
+        """
+        Method to send the message of a state to a member over its pooled connection.
+        An ELECTION gets a deadline for the OK; a member which can not be reached counts
+        as failed when the timers next run
+        @return the connection used, None if the member could not be reached
+        """
+        try:
+            peer = self.get_connection(member)
+        except OSError as err:
+            print("Failed to connect to {}: {}".format(member, err))
+            peer = None
+        if peer is not None and not self.send_message(peer, state, body):
+            peer = None
         if state == State.SEND_ELECTION:
-            self.set_state(State.WAITING_FOR_OK, peer, switch_mode=True)
-        else:
-            self.set_quiescent(peer)
+            self.set_state(State.WAITING_FOR_OK, peer_pid, ASSUME_FAILURE_TIMEOUT, self.ok_timeout, peer_pid)
+        if peer is None:
+            self.peer_failed(member)
+        return peer
 
-    def send(self, peer, message_name, message_data=None, wait_for_reply=False):
+    def peer_failed(self, member):
         """
-        Method to send Message
+        Method called when the connection to a member broke: whatever we wait for from it
+        times out right away. Deferred to the timers so it never runs inside a send
         """
-        message = (message_name, message_data)
-        message = pickle.dumps(message)
-        if self.bully == peer:
-            print("Pickled message is ")
-        peer.sendall(message)
-        if not wait_for_reply:
-            self.selector.unregister(peer)
-            peer.close()
+        for peer_pid, addr in self.members.items():
+            if addr == member:
+                self.syncing.discard(peer_pid)
+                if self.get_state(peer_pid) == State.WAITING_FOR_OK:
+                    self.set_state(State.WAITING_FOR_OK, peer_pid, 0, self.ok_timeout, peer_pid)
+                if peer_pid == self.bully and peer_pid != self.pid:
+                    self.timers.schedule(0, self.suspect, peer_pid)
+                if peer_pid in self.queried:
+                    self.timers.schedule(0, self.leader_answer, peer_pid)
+
+    def send(self, peer, message_name, body=b''):
+        """
+        Method to send Message with my membership version and term, the connection stays open for the next one
+        """
+        self.pool.send(peer, encode(message_name, self.pid, self.listener_addr, self.version, self.term, body))
 
     def receive_message(self, peer):
         """
-        Method to receive data
+        Method to receive data. Several messages may arrive in one read, or one message
+        over several reads, so the bytes go through the stream decoder of the connection
         """
         try:
-            recvData = peer.recv(4098)
-            recvDict = pickle.loads(recvData)
-            if recvDict:
-                message_name, message_data = recvDict
-                print("Received: ", message_name)
-                if message_data != 'NONE':
-                    self.update_members(message_data)
-                if message_name == 'ELECTION':
-                    if not self.is_election_in_progress():
-                        self.states[self.listener] = 'ELECTION_IN_PROGRESS'
-                        self.set_state(State.SEND_OK, peer)
-                        self.send_message(peer)
-                        self.start_election('ELECTION')
-                elif message_name == 'OK':
-                    if self.states[peer] == State.WAITING_FOR_OK:
-                        self.set_state(State.QUIESCENT, peer)
-                        self.set_quiescent()
-                elif message_name == 'COORDINATOR':
-                    self.set_quiescent()
-                    self.bully = peer.getsockname()
-                    print("Bully self is {0}".format(self.bully))
-                    print("Bully address is {0}".format(peer))
-                    self.send_probe(peer)
-                elif message_name == 'PROBE':
-                    self.set_state(State.SEND_OK, peer)
-                    self.send_message(peer)
+            recvData = peer.recv(BUF_SZ)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            recvData = b''
+        if not recvData:
+            self.pool.fail(peer)
+            return
+        self.pool.touch(peer)
+        try:
+            messages = self.pool.decoders[peer].feed(recvData)
+        except ValueError as err:
+            print("Dropping connection {}: {}".format(self.pr_sock(peer), err))
+            self.pool.fail(peer)
+            return
+        for recvDict in messages:
+            self.handle_message(peer, recvDict)
+
+    def handle_message(self, peer, recvDict):
+        """
+        Method to act on one received message
+        """
+        message_name, (peer_pid, peer_addr), version, term, body = recvDict
+        if message_name != 'HEARTBEAT':
+            print("Received: ", message_name)
+        self.term = max(self.term, term)
+        self.removed.discard(peer_pid)
+        self.add_member(peer_pid, peer_addr)
+        self.detector.heartbeat(peer_pid)  # Every message counts as a heartbeat
+        if message_name == 'SYNC':
+            self.send_message(peer, State.SEND_DELTA, encode_delta(*self.members_since(body)))
+            return
+        if message_name == 'DELTA':
+            self.apply_delta(peer_pid, version, *body)
+            return
+        self.check_version(peer, peer_pid, version)
+        if message_name == 'ELECTION':
+            self.send_message(peer, State.SEND_OK)
+            if not body or (self.bully is not None and self.bully > self.pid):
+                self.start_election('ELECTION')  # The bully the sender gave up on may still answer me
+            elif self.bully == self.pid and self.leader_term == self.term:
+                if time.monotonic() - self.declared < ASSUME_FAILURE_TIMEOUT:
+                    self.send_message(peer, State.SEND_VICTORY)  # Only the sender missed my victory
+                else:
+                    self.declare_victory('ELECTION from {}, others may have given up on me'.format(peer_pid))
             else:
-                self.selector.unregister(peer)
-                peer.close()
-        except Exception:
-            self.selector.unregister(peer)
-            peer.close()
+                self.begin_election('ELECTION')
+                self.declare_victory('ELECTION from {} found no bigger live pid'.format(peer_pid))
+        elif message_name == 'OK':
+            if self.get_state() == State.WAITING_FOR_OK and peer_pid > self.pid:
+                for waiting_pid, state in list(self.states.items()):
+                    if waiting_pid is not None and state == State.WAITING_FOR_OK:
+                        self.set_quiescent(waiting_pid)
+                self.set_state(State.WAITING_FOR_VICTOR, None, VICTOR_TIMEOUT, self.victor_timeout)
+        elif message_name == 'COORDINATOR':
+            if self.election_mode == 'modified' and not self.accept_victory(peer_pid, term):
+                return
+            self.end_election()
+            self.clear_election()
+            self.set_leader(peer_pid)
+            self.leader_term = term
+            print("The Leader is: {} [{}]".format(self.pr_leader(), self.pr_now()))
+        elif message_name == 'LEADER_QUERY':
+            body = b''  # No leader known, or it is being elected
+            if self.bully in self.members and not self.is_election_in_progress():
+                body = encode_leader(self.bully, self.members[self.bully], self.leader_term)
+            self.send_message(peer, State.SEND_LEADER, body)
+        elif message_name == 'LEADER':
+            self.leader_answer(peer_pid, body)
+        elif message_name == 'HEARTBEAT':
+            if self.bully is not None and peer_pid > max(self.pid, self.bully) and not self.is_election_in_progress():
+                self.start_election('HEARTBEAT from {}'.format(peer_pid))  # A bigger pid is back
 
     def get_connection(self, member):
         """
-        Method to create socket
+        Method to get the pooled connection to a member, opening it if needed
         """
-        print("Inside getConnection members {0}".format(member))
-        listener = member
-        peer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        peer.connect(listener)
-        self.selector.register(peer, selectors.EVENT_WRITE, data=None)
-        print("Getting out of get_connection")
-        return peer
+        return self.pool.get(tuple(member))
 
     def get_state(self, peer=None):
         """
-        Look up current state in state table.
+        Look up current state in state table, peer None for my own state.
         """
-        if peer is None:
-            peer = self
         status = self.states[peer] if peer in self.states else State.QUIESCENT
         return status
 
-    def set_state(self, state, peer=None, switch_mode=False):
+    def set_state(self, state, peer=None, timeout=None, on_timeout=None, *args):
         """
-        Method to update the state of socket
+        Method to update the state of a peer (None for myself), replacing the deadline
+        of its previous state by on_timeout(*args) after timeout seconds if given
         """
-        if switch_mode:
-            self.states[self.listener] = state
-        else:
-            self.states[peer] = state
+        self.timers.cancel(self.deadlines.pop(peer, None))
+        if state == State.QUIESCENT:
+            self.states.pop(peer, None)
+            return
+        self.states[peer] = state
+        if timeout is not None:
+            self.deadlines[peer] = self.timers.schedule(timeout, on_timeout, *args)
 
     def is_election_in_progress(self):
         """
         Method to check if election is in progress
         """
-        if self.states[self.listener] == 'ELECTION_IN_PROGRESS':
-            return True
-        else:
+        return self.get_state() in (State.WAITING_FOR_OK, State.WAITING_FOR_VICTOR)
+
+    def accept_victory(self, peer_pid, term):
+        """
+        Modified mode check of a COORDINATOR: one from a smaller pid than mine starts an
+        election, one older than the victory of my bully is ignored
+        @return True if the sender is the new leader
+        """
+        if peer_pid < self.pid:  # It did not know about me, bully it
+            self.set_leader(None)
+            self.start_election('COORDINATOR from {}'.format(peer_pid))
             return False
+        if self.bully is not None and peer_pid < self.bully and term <= self.leader_term:
+            print("Ignoring COORDINATOR of {} in term {}, older than {} [{}]".format(
+                peer_pid, term, self.pr_leader(), self.pr_now()))
+            return False
+        return True
 
     def set_leader(self, new_leader):
         """
-        Method to update the leader
+        Method to update the leader, and with it the peers the failure detector watches
         """
         self.bully = new_leader
+        self.detector.watch(self.heartbeat_peers())
 
     def set_quiescent(self, peer=None):
         """
         Method to update state to quiesent
         """
-        self.set_state(State.QUIESCENT, peer, switch_mode=True)
+        self.set_state(State.QUIESCENT, peer)
+
+    def clear_election(self):
+        """
+        Method to forget the state and deadlines of an election
+        """
+        for peer in list(self.states):
+            self.set_quiescent(peer)
+        self.candidates = []
 
     def declare_victory(self, reason):
         """
         Declare victory to peers
         """
-        if self.bully == self.pid:
-            print("The Leader is: {} as {}".format(self.pr_leader(), reason))
-            for member in self.members.items():
-                pid, addr = member
-                if self.listener_addr != addr:
-                    print("self.listener_addr != addr bcoz self.listener_addr is {0} and addr is {1}".format(self.listener_addr, addr))
-                    peer = self.get_connection(addr)
-                    self.states[peer] = State.SEND_VICTORY
-                    self.send_message(peer)
+        self.clear_election()
+        self.set_leader(self.pid)
+        self.term += 1
+        self.leader_term = self.term
+        self.declared = time.monotonic()
+        print("The Leader is: {} as {} [{}]".format(self.pr_leader(), reason, self.pr_now()))
+        for pid, addr in list(self.members.items()):
+            if pid != self.pid and self.listener_addr != addr:
+                self.send_to(pid, addr, State.SEND_VICTORY)
+        self.end_election()
 
     # Helper printing methods
     @staticmethod
@@ -304,9 +627,12 @@ class lab2:
         """
         Static version of helper for printing given socket
         """
-        l_port = sock.getsockname()[1] % PEER_DIGITS
         try:
-            r_port = sock.getsockname()[1] % PEER_DIGITS
+            l_port = sock.getsockname()[1] % PEER_DIGITS
+        except OSError:  # Closed while an earlier message of the same read was handled
+            l_port = '???'
+        try:
+            r_port = sock.getpeername()[1] % PEER_DIGITS
         except OSError:
             r_port = '???'
         return '{}->{} ({})'.format(l_port, r_port, id(sock))
@@ -322,41 +648,64 @@ class lab2:
         template = '{0.pid}'
         return template.format(self)
 
-    def send_probe(self, peer):
+    def heartbeat_peers(self):
         """
-        Probe message send by group members to the bully
+        Method to list the peers I exchange heartbeats with: every member if I am the bully, else the bully
         """
-        max_pid = max(self.members)
-        addr = self.members.get(max_pid)
-        message_name = 'PROBE'
-        message_data = 'NONE'
-        while True:
-            s = self.get_connection(addr)
-            self.states[peer] = State.SEND_PROBE
-            self.send(s, message_name, message_data, True)
-            print("Sent probe to bully")
-            recvData = s.recv(4098)
-            recvList = pickle.loads(recvData)
-            value, members = recvList
-            if "OK" != value:
-                break
-            time.sleep(3)
-        self.start_election()
+        if self.bully == self.pid:
+            return [pid for pid in self.members if pid != self.pid]
+        if self.bully is not None and self.bully in self.members:
+            return [self.bully]
+        return []
 
+    def send_heartbeats(self):
+        """
+        Heartbeats go out every HEARTBEAT_INTERVAL in one batch over the pooled connections,
+        from the bully to every member and from every member to the bully
+        """
+        self.timers.schedule(HEARTBEAT_INTERVAL, self.send_heartbeats)
+        peers = self.heartbeat_peers()
+        self.detector.watch(peers)
+        for pid in peers:
+            self.send_to(pid, self.members[pid], State.SEND_HEARTBEAT)
+
+    def check_failures(self):
+        self.timers.schedule(FAILURE_CHECK_INTERVAL, self.check_failures)
+        self.detector.check()
+
+    def suspect(self, pid):
+        """
+        Failure detector event: a watched peer stopped sending heartbeats or its connection
+        broke. A suspected bully is elected again, a member suspected by the bully is removed
+        """
+        if pid == self.bully and pid != self.pid:
+            print("Bully {} suspected [{}]".format(pid, self.pr_now()))
+            self.remove_member(pid)
+            self.set_leader(None)
+            self.start_election('{} suspected'.format(pid))
+        elif self.bully == self.pid and pid in self.members:
+            print("Member {} suspected [{}]".format(pid, self.pr_now()))
+            self.remove_member(pid)
+
+    def alive(self, pid):
+        """
+        Failure detector event: a suspected peer sends messages again, which made it a member again
+        """
+        print("{} is alive again [{}]".format(pid, self.pr_now()))
 
 if __name__ == '__main__':
     """
-    Commandline expected in below format: python lab2.py localhost Port DOB SU_ID
+    Commandline expected in below format: python lab2.py localhost Port DOB SU_ID [bully|modified]
     """
-    if len(sys.argv) != 5:
-        print("Usage: python3 lab2.py GCDHOST GCDPORT your birthday your SUID")
+    if len(sys.argv) not in (5, 6):
+        print("Usage: python3 lab2.py GCDHOST GCDPORT your birthday your SUID [{}]".format('|'.join(ELECTION_MODES)))
     else:
         gcd_address = (sys.argv[1], sys.argv[2])
         next_birthday = parse(sys.argv[3])
         su_id = int(sys.argv[4])
-        myself = lab2(gcd_address, next_birthday, su_id)
+        election_mode = sys.argv[5] if len(sys.argv) == 6 else ELECTION_MODE
+        myself = lab2(gcd_address, next_birthday, su_id, election_mode)
         recvList = myself.join_group()
         myself.update_members(recvList)
-        myself.states[myself.listener] = 'ELECTION_IN_PROGRESS'
-        myself.start_election('JOIN')
+        myself.discover_leader()
         myself.run()
@@ -0,0 +1,156 @@
+import errno
+import os
+import selectors
+import socket
+import time
+
+from bully_codec import stream_decoder
+
+POOL_IDLE_TIMEOUT = 60.0  # Seconds a connection may go unused before it is closed
+
+
+class peer_pool(object):
+    """
+    Long-lived connections between the group members. Connections we open are kept
+    per peer listener address and reused for every message to that peer; connections
+    peers opened to us are kept too, so replies go back over them. Unused connections
+    are closed by evict_idle and a broken one is reopened on the next get.
+
+    Every socket is non-blocking: connects complete in the selector loop, and outgoing
+    bytes wait in a per connection outbox until the socket is writable. A connection
+    which fails is reported to on_failure with the peer listener address.
+    """
+
+    def __init__(self, selector, on_failure=None, idle_timeout=POOL_IDLE_TIMEOUT):
+        self.selector = selector
+        self.on_failure = on_failure
+        self.idle_timeout = idle_timeout
+        self.connections = {}  # Peer listener address -> socket we opened to it
+        self.addresses = {}    # Socket -> peer listener address, None for connections accepted from peers
+        self.last_used = {}    # Socket -> time.monotonic() of its last send or receive
+        self.decoders = {}     # Socket -> stream_decoder of the bytes received on it
+        self.outboxes = {}     # Socket -> bytes waiting to be sent
+        self.connecting = set()  # Sockets whose connect has not completed yet
+        self.connects = 0      # Connections opened, for comparing with the number of messages sent
+        self.next_eviction = 0.0  # time.monotonic() evict_idle looks at the connections again after
+
+    def __contains__(self, peer):
+        return peer in self.addresses
+
+    def get(self, address):
+        """
+        Method to find the open connection to a peer listener, or start opening one.
+        Messages can be sent on it right away, they go out once it is connected
+        """
+        peer = self.connections.get(address)
+        if peer is None:
+            peer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            peer.setblocking(False)
+            err = peer.connect_ex(address)
+            if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                peer.close()
+                raise ConnectionError(err, os.strerror(err))
+            self.connects += 1
+            self.connections[address] = peer
+            self.add(peer, address, connecting=err != 0)
+        return peer
+
+    def add(self, peer, address=None, connecting=False):
+        """
+        Method to take a connection into the pool and watch it for incoming messages
+        """
+        peer.setblocking(False)
+        self.addresses[peer] = address
+        self.last_used[peer] = time.monotonic()
+        self.decoders[peer] = stream_decoder()
+        self.outboxes[peer] = bytearray()
+        events = selectors.EVENT_READ
+        if connecting:
+            self.connecting.add(peer)
+            events |= selectors.EVENT_WRITE
+        self.selector.register(peer, events, data=None)
+
+    def send(self, peer, data):
+        """
+        Method to queue bytes on a connection and send as much of them as the socket takes
+        """
+        if peer not in self.outboxes:
+            raise ConnectionError("connection already closed")
+        self.outboxes[peer] += data
+        self.touch(peer)
+        if peer not in self.connecting:
+            self.flush(peer)
+
+    def flush(self, peer):
+        outbox = self.outboxes[peer]
+        try:
+            if outbox:
+                del outbox[:peer.send(outbox)]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self.fail(peer)
+            return
+        self.selector.modify(peer, selectors.EVENT_READ | (selectors.EVENT_WRITE if outbox else 0))
+
+    def writable(self, peer):
+        """
+        Method for the selector loop: completes a connect, or sends more of the outbox
+        """
+        if peer not in self.addresses:
+            return
+        if peer in self.connecting:
+            if peer.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                self.fail(peer)
+                return
+            self.connecting.discard(peer)
+        self.flush(peer)
+
+    def fail(self, peer):
+        """
+        Method to drop a broken connection and report the peer it led to
+        """
+        address = self.addresses.get(peer)
+        self.discard(peer)
+        if address is not None and self.on_failure is not None:
+            self.on_failure(address)
+
+    def touch(self, peer):
+        if peer in self.last_used:
+            self.last_used[peer] = time.monotonic()
+
+    def discard(self, peer):
+        """
+        Method to close a connection and forget it, the next get opens a new one
+        """
+        address = self.addresses.pop(peer, None)
+        if address is not None and self.connections.get(address) is peer:
+            del self.connections[address]
+        self.last_used.pop(peer, None)
+        self.decoders.pop(peer, None)
+        self.outboxes.pop(peer, None)
+        self.connecting.discard(peer)
+        try:
+            self.selector.unregister(peer)
+        except (KeyError, ValueError):
+            pass
+        peer.close()
+
+    def evict_idle(self):
+        """
+        Method to close the connections unused for longer than the idle timeout. It runs
+        on every pass of the event loop, so the connections are only looked at a few
+        times per idle timeout
+        """
+        now = time.monotonic()
+        if now < self.next_eviction:
+            return
+        self.next_eviction = now + self.idle_timeout / 4
+        oldest = now - self.idle_timeout
+        for peer, used in list(self.last_used.items()):
+            if used < oldest and not self.outboxes[peer]:
+                self.discard(peer)
+
+    def close(self):
+        for peer in list(self.addresses):
+            self.discard(peer)
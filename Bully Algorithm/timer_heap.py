@@ -0,0 +1,56 @@
+import heapq
+import itertools
+import time
+
+
+class timer_heap(object):
+    """
+    Deadlines of the event loop kept in a min-heap. Cancelled timers stay in the heap
+    and are skipped when they come up; cancelling a timer which already ran or was
+    skipped does nothing.
+    """
+
+    def __init__(self):
+        self.heap = []                  # (time.monotonic() deadline, timer id, callback, args)
+        self.counter = itertools.count()
+        self.pending = set()            # Ids of the timers still in the heap
+        self.cancelled = set()          # Ids of the cancelled timers still in the heap
+
+    def schedule(self, delay, callback, *args):
+        """
+        Method to call callback(*args) from run_due once delay seconds have passed
+        @return timer id for cancel
+        """
+        timer = next(self.counter)
+        heapq.heappush(self.heap, (time.monotonic() + delay, timer, callback, args))
+        self.pending.add(timer)
+        return timer
+
+    def cancel(self, timer):
+        if timer in self.pending:
+            self.cancelled.add(timer)
+
+    def timeout(self, longest):
+        """
+        Method to work out how long the selector may wait before the next deadline
+        """
+        while self.heap and self.heap[0][1] in self.cancelled:
+            timer = heapq.heappop(self.heap)[1]
+            self.pending.discard(timer)
+            self.cancelled.discard(timer)
+        if not self.heap:
+            return longest
+        return max(0, min(longest, self.heap[0][0] - time.monotonic()))
+
+    def run_due(self):
+        """
+        Method to call back every timer whose deadline has passed
+        """
+        now = time.monotonic()
+        while self.heap and self.heap[0][0] <= now:
+            deadline, timer, callback, args = heapq.heappop(self.heap)
+            self.pending.discard(timer)
+            if timer in self.cancelled:
+                self.cancelled.discard(timer)
+                continue
+            callback(*args)
@@ -0,0 +1,125 @@
+"""
+@author: Aishwarya Supekar
+Seattle University
+"""
+import logging
+import time
+from bellman_ford import bellman_ford, ENGINES
+from cycle_cache import cycle_cache
+from incremental_bellman_ford import incremental_bellman_ford
+from metrics import LOGGER
+from quote_store import quote_store
+
+logger = logging.getLogger(LOGGER)
+
+MONEY_INVESTMENT = 100.00                     # $ 100 investment for the currency conversion profit
+SOLVER_ENGINE = 'python'                      # Bellman ford engine, one of bellman_ford.ENGINES
+INCREMENTAL_SOLVE = False                     # Re-relax only the changed edges instead of a full solve per datagram
+QUOTE_TTL = 1.5                               # Seconds a quote stays in the graph without a refresh, None to keep forever
+CYCLE_CACHE = True                            # Re-price recently found paths before running the solver
+FULL_SOLVE_PERIOD = 1.0                       # Seconds between full solves while the cycle cache keeps hitting
+
+
+class arbitrage_finder(object):
+    """
+    Live quotes together with the configured solver. Used by fxp_bytes_subscriber
+    directly, or from the worker process in pipelined mode
+    """
+
+    def __init__(self, engine=SOLVER_ENGINE, incremental=INCREMENTAL_SOLVE, ttl=QUOTE_TTL, cache=CYCLE_CACHE,
+                 metrics=None):
+        """
+        @param metrics pipeline_metrics to record the solves in, None to not record them
+        """
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine %s, expected one of %s" % (engine, ", ".join(ENGINES)))
+        self.engine = engine
+        self.incremental = incremental
+        self.quotes = quote_store(ttl=ttl)  # Live feed
+        self.detector = incremental_bellman_ford()
+        self.cache = cycle_cache() if cache else None
+        self.bellmanFord = bellman_ford()
+        self.pendingChanges = {}      # Changed edges not yet given to the incremental detector
+        self._solved_at = 0           # time.monotonic() of the last full solve
+        self.metrics = metrics
+
+    def generate_graph(self):
+        """
+        Method to generate graph from the recived live data
+        @return graph
+        """
+        return self.quotes.graph()
+
+    def path_graph(self, path):
+        """
+        Method to generate the graph of just the edges along a path, enough to print it
+        @return graph
+        """
+        graph = {}
+        for ver1, ver2 in zip(path, path[1:]):
+            graph.setdefault(ver1, {})[ver2] = self.quotes.weight(ver1, ver2)
+        return graph
+
+    def expire_quotes(self):
+        """
+        Method to drop the quotes which were not refreshed within the ttl
+        """
+        expired = self.quotes.expire(int(time.time() * 1000000))
+        if self.metrics is not None:
+            self.metrics.expired += len(expired)
+        if logger.isEnabledFor(logging.DEBUG):
+            for cur1, cur2 in expired:
+                logger.debug("removing expired quote for %s %s", self.quotes.currencies[cur1],
+                             self.quotes.currencies[cur2])
+
+    def take_changes(self):
+        """
+        Method to collect the edges changed since the last solve
+        @return dictionary of (currency1, currency2) -> log rate
+        """
+        return self.quotes.take_changes()
+
+    def find_arbitrage(self):
+        """
+        Method to look for arbitrage after the live feed changed. Paths found earlier are
+        re-priced first and the solver only runs when none of them is profitable any
+        more, or every FULL_SOLVE_PERIOD seconds
+        @return Path with arbitrage or None
+        """
+        changes = self.take_changes()
+        self.pendingChanges.update(changes)
+        if self.cache is not None:
+            path = self.cache.reprice(self.quotes.weight, changes, MONEY_INVESTMENT)
+            if path and time.monotonic() - self._solved_at < FULL_SOLVE_PERIOD:
+                return path
+        path = self.solve()
+        if path and self.cache is not None:
+            self.cache.add(path)
+        return path
+
+    def solve(self):
+        """
+        Method to run the configured solver on the live feed
+        @return Path with arbitrage or None
+        """
+        self._solved_at = started = time.monotonic()
+        changes, self.pendingChanges = self.pendingChanges, {}
+        if self.incremental:
+            path = self.detector.update(changes, 'USD', MONEY_INVESTMENT)
+        elif self.engine == 'numpy':
+            currencies, weights = self.quotes.weight_matrix()
+            built = time.monotonic()
+            path = self.bellmanFord.bellmanFordMatrix(currencies, weights, 'USD', MONEY_INVESTMENT)
+        else:
+            graph = self.generate_graph()
+            built = time.monotonic()
+            path = getattr(self.bellmanFord, ENGINES[self.engine])(graph, 'USD', MONEY_INVESTMENT)
+        if self.metrics is not None:
+            finished = time.monotonic()
+            if self.incremental:
+                built = started
+            else:
+                self.metrics.graph.add(built - started)
+            self.metrics.solve.add(finished - built)
+            self.metrics.solves += 1
+        return path
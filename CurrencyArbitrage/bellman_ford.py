@@ -3,14 +3,26 @@
 @author: Aishwarya Supekar
 Seattle University
 """
+import heapq
 import math
+from collections import defaultdict, deque, namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed by the 'numpy' engine
+    np = None
 
 TOLERANCE = 0.000000000001
+ENGINES = {'python': 'bellmanFord', 'numpy': 'bellmanFordNumpy', 'spfa': 'bellmanFordSpfa'}  # engine name -> solver method
+TOP_ARBITRAGES = 10     # Number of cycles kept by findAllArbitrage
+
+Arbitrage = namedtuple('Arbitrage', ['path', 'rates', 'profit'])  # One profitable cycle, path starts and ends at the same currency
 
 class bellman_ford(object):
     """
     Bellman ford class to find the Arbitrage in currency
     """
+    relaxations = 0     # Edges scanned by the solvers, read by bench_bellman_ford
     
     def initializeDictionaries(self,graph, source):
         """
@@ -55,6 +67,30 @@ class bellman_ford(object):
             else:
                 return
 
+    def cyclePath(self, graph, predecessorNode, source, start, end):
+        """
+        Method to build the arbitrage path for the cycle closed by the edge end -> start,
+        where start is on the predecessor path of end. Like backtrack the path starts
+        and ends at the source
+        @return Path with arbitrage or None if the way back to the source is missing
+        """
+        cycle = [end]
+        while cycle[-1] != start:
+            cycle.append(predecessorNode[cycle[-1]])
+        cycle.reverse()
+        cycle.append(start)
+        toStart = [start]
+        while toStart[-1] != source:
+            if predecessorNode[toStart[-1]] is None:
+                return None
+            toStart.append(predecessorNode[toStart[-1]])
+        toStart.reverse()
+        path = toStart[:-1] + cycle + list(reversed(toStart[:-1]))
+        for ver1, ver2 in zip(path, path[1:]):
+            if ver2 not in graph[ver1]:
+                return None
+        return path
+
     def getProfit(self, graph, source, path, initialInvestment):
         """
         Method to check if the profit is above 1 dollar
@@ -78,6 +114,7 @@ class bellman_ford(object):
         distanceFromNode, predecessorNode = self.initializeDictionaries(graph, source)
         for i in range(len(graph)-1):
             for ver1 in graph:
+                self.relaxations += len(graph[ver1])
                 for ver2 in graph[ver1]:
                     self.relaxEdges(ver1, ver2, graph, distanceFromNode, predecessorNode)
                     if(distanceFromNode[source] < 0 - TOLERANCE):
@@ -88,17 +125,245 @@ class bellman_ford(object):
                 for ver2 in graph[ver1]:
                     if distanceFromNode[ver1]!= float("Inf") and distanceFromNode[ver2] < distanceFromNode[ver1] + graph[ver1][ver2]:
                         path = self.backtrack(predecessorNode, source)
-                        if(self.getProfit(graph, source, path, money)):
+                        if(path and self.getProfit(graph, source, path, money)):
                             return(path)
         return None
 
+    def bellmanFordSpfa(self, graph, source, money):
+        """
+        Queue based Bellman ford (SPFA). Only vertices whose distance changed are scanned
+        again. Negative cycles are caught as soon as they close with Tarjan's subtree
+        disassembly: when a vertex gets a shorter distance its subtree in the shortest
+        path tree is taken apart, and finding the tail of the relaxed edge in that
+        subtree means the edge closes a cycle
+        """
+        distanceFromNode, predecessorNode = self.initializeDictionaries(graph, source)
+        children = defaultdict(set)  # Shortest path tree, vertex -> vertices it is predecessor of
+        queue = deque([source])
+        active = {source}            # Queued vertices which are still attached to the tree
+        while queue:
+            ver1 = queue.popleft()
+            if ver1 not in active:
+                continue
+            active.discard(ver1)
+            self.relaxations += len(graph[ver1])
+            for ver2, weight in graph[ver1].items():
+                distance = distanceFromNode[ver1] + weight
+                if distance < distanceFromNode[ver2] - TOLERANCE:
+                    subtree = self.collectSubtree(children, ver2)
+                    if ver1 in subtree:
+                        path = self.cyclePath(graph, predecessorNode, source, ver2, ver1)
+                        if path and self.getProfit(graph, source, path, money):
+                            return path
+                        continue
+                    for vertex in subtree:
+                        children[vertex].clear()
+                        if vertex != ver2:
+                            active.discard(vertex)
+                    if predecessorNode[ver2] is not None:
+                        children[predecessorNode[ver2]].discard(ver2)
+                    distanceFromNode[ver2] = distance
+                    predecessorNode[ver2] = ver1
+                    children[ver1].add(ver2)
+                    if ver2 not in active:
+                        active.add(ver2)
+                        queue.append(ver2)
+        return None
 
+    def collectSubtree(self, children, root):
+        """
+        Method to collect the root and every vertex below it in the shortest path tree
+        @return set of vertices
+        """
+        subtree = {root}
+        stack = [root]
+        while stack:
+            for child in children[stack.pop()]:
+                if child not in subtree:
+                    subtree.add(child)
+                    stack.append(child)
+        return subtree
+
+    def buildMatrix(self, graph):
+        """
+        Method to convert the dict-of-dicts graph into a dense weight matrix
+        @return currencies, weights (weights[i][j] is inf where there is no edge)
+        """
+        currencies = list(graph)
+        index = {currency: i for i, currency in enumerate(currencies)}
+        for ver1 in graph:
+            for ver2 in graph[ver1]:
+                if ver2 not in index:
+                    index[ver2] = len(currencies)
+                    currencies.append(ver2)
+        weights = np.full((len(currencies), len(currencies)), np.inf)
+        for ver1, edges in graph.items():
+            for ver2, weight in edges.items():
+                weights[index[ver1], index[ver2]] = weight
+        return currencies, weights
 
-    def findArbitartion(self,graph, source, money):
+    def getProfitMatrix(self, currencies, weights, path, initialInvestment):
+        """
+        Same check as getProfit but reading the rates from the weight matrix
+        """
+        index = {currency: i for i, currency in enumerate(currencies)}
+        profit = initialInvestment
+        for start, end in zip(path, path[1:]):
+            profit = profit * math.exp(-weights[index[start], index[end]])
+        return profit > initialInvestment
+
+    def bellmanFordNumpy(self, graph, source, money):
+        """
+        Bellman ford on a dense NumPy matrix. Same result format as bellmanFord
+        """
+        if np is None:
+            raise ImportError("numpy is required for the 'numpy' engine")
+        currencies, weights = self.buildMatrix(graph)
+        return self.bellmanFordMatrix(currencies, weights, source, money)
+
+    def bellmanFordMatrix(self, currencies, weights, source, money):
+        """
+        Vectorized Bellman ford. Every pass relaxes all the edges with one min-reduction
+        over the columns of distance + weights
+        @param currencies list of currency names, position i is row/column i of weights
+        @param weights square matrix of log rates, inf where there is no edge
+        @return Path with arbitrage or None
+        """
+        if source not in currencies:
+            return None
+        size = len(currencies)
+        sourceIndex = currencies.index(source)
+        columns = np.arange(size)
+        distanceFromNode = np.full(size, np.inf)
+        distanceFromNode[sourceIndex] = 0
+        predecessorNode = np.full(size, -1, dtype=np.intp)
+        # Passes beyond size - 1 only happen when there is a negative cycle; they give
+        # the cycle time to reach back to the source, as the in-place updates of
+        # bellmanFord do within one pass
+        for i in range(2 * size):
+            self.relaxations += size * size
+            candidates = distanceFromNode[:, np.newaxis] + weights
+            best = candidates.argmin(axis=0)
+            bestDistance = candidates[best, columns]
+            relaxed = bestDistance < distanceFromNode - TOLERANCE
+            if not relaxed.any():
+                return None
+            distanceFromNode[relaxed] = bestDistance[relaxed]
+            predecessorNode[relaxed] = best[relaxed]
+            if distanceFromNode[sourceIndex] < 0 - TOLERANCE:
+                path = self.backtrackMatrix(currencies, predecessorNode, source)
+                if path and self.getProfitMatrix(currencies, weights, path, money):
+                    return path
+        path = self.backtrackMatrix(currencies, predecessorNode, source)
+        if path and self.getProfitMatrix(currencies, weights, path, money):
+            return path
+        return None
+
+    def backtrackMatrix(self, currencies, predecessors, source):
+        """
+        Method to backtrack from an array of predecessor indexes
+        @return Path with arbitrage, same format as backtrack
+        """
+        predecessorNode = {currency: (currencies[predecessors[i]] if predecessors[i] >= 0 else None)
+                           for i, currency in enumerate(currencies)}
+        return self.backtrack(predecessorNode, source)
+
+    def findArbitartion(self,graph, source, money, engine='python'):
         """
         Driver method to find and print arbritarage in currencies
+        @param engine name of the solver to use, one of ENGINES
+        """
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine %s, expected one of %s" % (engine, ", ".join(ENGINES)))
+        path = getattr(self, ENGINES[engine])(graph, source, money)
+        self.printArbitrage(graph, path, money)
+
+    def findAllArbitrage(self, graph, sources, money, top=TOP_ARBITRAGES):
+        """
+        Method to collect the profitable cycles reachable from any of the source currencies
+        in a single solve. All sources start at distance 0 (as if linked from one virtual
+        source), and every cycle which closes during the queue based relaxation is recorded
+        and its closing edge blocked, so the search goes on to the next cycle instead of
+        stopping at the first one. Cycles are deduplicated by rotation and ranked by
+        profit per hop
+        @param sources iterable of base currencies
+        @param top number of best cycles to keep
+        @return list of Arbitrage, best first
+        """
+        distanceFromNode = {vertex: float("Inf") for vertex in graph}
+        predecessorNode = {vertex: None for vertex in graph}
+        children = defaultdict(set)
+        queue = deque()
+        for source in sources:
+            if source in distanceFromNode:
+                distanceFromNode[source] = 0
+                queue.append(source)
+        active = set(queue)
+        blocked = set()   # Edges which closed a cycle already
+        seen = set()      # Canonical rotation of every recorded cycle
+        best = []         # Min-heap of (profit per hop, tie breaker, Arbitrage), at most top entries
+        while queue:
+            ver1 = queue.popleft()
+            if ver1 not in active:
+                continue
+            active.discard(ver1)
+            for ver2, weight in graph[ver1].items():
+                distance = distanceFromNode[ver1] + weight
+                if (ver1, ver2) in blocked or distance >= distanceFromNode[ver2] - TOLERANCE:
+                    continue
+                subtree = self.collectSubtree(children, ver2)
+                if ver1 in subtree:
+                    blocked.add((ver1, ver2))
+                    cycle = [ver1]
+                    while cycle[-1] != ver2:
+                        cycle.append(predecessorNode[cycle[-1]])
+                    cycle.reverse()
+                    self.recordCycle(graph, cycle, sources, money, top, seen, best)
+                    continue
+                for vertex in subtree:
+                    children[vertex].clear()
+                    if vertex != ver2:
+                        active.discard(vertex)
+                if predecessorNode[ver2] is not None:
+                    children[predecessorNode[ver2]].discard(ver2)
+                distanceFromNode[ver2] = distance
+                predecessorNode[ver2] = ver1
+                children[ver1].add(ver2)
+                if ver2 not in active:
+                    active.add(ver2)
+                    queue.append(ver2)
+        return [arbitrage for perHop, order, arbitrage in sorted(best, reverse=True)]
+
+    def recordCycle(self, graph, cycle, sources, money, top, seen, best):
+        """
+        Helper method to price a cycle and keep it if it is among the top best ones
+        @param cycle list of distinct currencies, the last one trades back to the first
+        """
+        first = cycle.index(min(cycle))
+        canonical = tuple(cycle[first:] + cycle[:first])
+        if canonical in seen:
+            return
+        seen.add(canonical)
+        bases = [i for i, currency in enumerate(cycle) if currency in sources]
+        start = bases[0] if bases else first
+        path = cycle[start:] + cycle[:start] + [cycle[start]]
+        rates = [math.exp(-graph[ver1][ver2]) for ver1, ver2 in zip(path, path[1:])]
+        final = money
+        for rate in rates:
+            final = final * rate
+        if final <= money:
+            return
+        perHop = (math.log(final) - math.log(money)) / len(rates)
+        entry = (perHop, -len(seen), Arbitrage(path, rates, final - money))
+        if len(best) < top:
+            heapq.heappush(best, entry)
+        elif entry > best[0]:
+            heapq.heapreplace(best, entry)
+
+    def printArbitrage(self, graph, path, money):
+        """
+        Method to print the exchanges along an arbitrage path
         """
-        path = self.bellmanFord(graph, 'USD', money)
         if path == None:
             return
         else:
@@ -0,0 +1,171 @@
+"""
+@author: Aishwarya Supekar
+Seattle University
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime
+from bellman_ford import bellman_ford, ENGINES, np
+from arbitrage_finder import MONEY_INVESTMENT
+
+SIZES = [10, 50, 100, 250, 500]               # Number of currencies of the generated graphs
+DENSITIES = [0.1, 0.5, 1.0]                   # Share of all the currency pairs which are quoted
+REPEATS = 20                                  # Timed solves per case
+TIME_BUDGET = 5.0                             # Seconds per case after which fewer solves are timed
+CYCLE_PROFIT = 0.01                           # Profit of the planted cycle
+SOURCE = 'USD'
+REGRESSION = 1.10                             # Median latency ratio reported as a regression by --compare
+
+
+def generate_graph(size, density, planted, seed=None):
+    """
+    Function to generate a graph in the format of fxp_bytes_subscriber.generate_graph.
+    The rates come from one price per currency, so there is no arbitrage unless a
+    triangle through the source is planted
+    @param size number of currencies
+    @param density probability of every currency pair being quoted
+    @param planted plant a profitable cycle
+    @return graph
+    """
+    rand = random.Random(seed)
+    currencies = [SOURCE] + ['C%03d' % number for number in range(1, size)]
+    prices = {currency: math.exp(rand.gauss(0, 1)) for currency in currencies}
+    graph = defaultdict(dict)
+    for i, cur1 in enumerate(currencies):
+        for cur2 in currencies[i + 1:]:
+            if rand.random() < density:
+                weight = -math.log(prices[cur2] / prices[cur1])
+                graph[cur1][cur2] = weight
+                graph[cur2][cur1] = -weight
+    if planted and size >= 3:
+        cur1, cur2 = rand.sample(currencies[1:], 2)
+        for ver1, ver2 in ((SOURCE, cur1), (cur1, cur2), (cur2, SOURCE)):
+            weight = -math.log(prices[ver2] / prices[ver1])
+            graph[ver1][ver2] = weight
+            graph[ver2][ver1] = -weight
+        graph[SOURCE][cur1] -= math.log(1 + CYCLE_PROFIT)
+        graph[cur1][SOURCE] = -graph[SOURCE][cur1]
+    return graph
+
+
+def percentile(values, share):
+    """
+    Function to read a percentile of sorted values, nearest rank
+    """
+    return values[min(len(values) - 1, max(0, math.ceil(share * len(values)) - 1))]
+
+
+def run_case(engine, graph, repeats, budget):
+    """
+    Function to time the solves of one engine on one graph
+    @return dictionary of the measurements
+    """
+    solver = bellman_ford()
+    solve = getattr(solver, ENGINES[engine])
+    latencies = []
+    found = 0
+    started = time.perf_counter()
+    while len(latencies) < repeats and (not latencies or time.perf_counter() - started < budget):
+        before = time.perf_counter()
+        path = solve(graph, SOURCE, MONEY_INVESTMENT)
+        latencies.append(time.perf_counter() - before)
+        found += path is not None
+    relaxations = solver.relaxations
+    tracemalloc.start()
+    solve(graph, SOURCE, MONEY_INVESTMENT)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies.sort()
+    return {
+        'runs': len(latencies),
+        'found': found,
+        'p50_ms': 1000 * percentile(latencies, 0.50),
+        'p90_ms': 1000 * percentile(latencies, 0.90),
+        'p99_ms': 1000 * percentile(latencies, 0.99),
+        'max_ms': 1000 * latencies[-1],
+        'relaxations_per_s': relaxations / sum(latencies) if sum(latencies) else None,
+        'peak_bytes': peak,
+    }
+
+
+def run(engines, sizes, densities, repeats=REPEATS, budget=TIME_BUDGET, seed=0):
+    """
+    Function to run every engine over every generated graph
+    @return list of result dictionaries, one per case
+    """
+    results = []
+    for size in sizes:
+        for density in densities:
+            for planted in (False, True):
+                graph = generate_graph(size, density, planted, seed)
+                edges = sum(len(edges) for edges in graph.values())
+                for engine in engines:
+                    result = {'engine': engine, 'currencies': size, 'density': density, 'planted': planted,
+                              'edges': edges}
+                    result.update(run_case(engine, graph, repeats, budget))
+                    print("{engine:>6} {currencies:>4} currencies density {density:<4} planted {planted!s:<5} "
+                          "p50 {p50_ms:10.3f} ms  p99 {p99_ms:10.3f} ms  peak {peak_bytes:>10} B".format(**result))
+                    results.append(result)
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION):
+    """
+    Function to print the median latency of every case against a saved run
+    @return number of cases slower than the baseline by more than the threshold
+    """
+    def key(result):
+        return result['engine'], result['currencies'], result['density'], result['planted']
+
+    previous = {key(result): result for result in baseline['results']}
+    regressions = 0
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or not old['p50_ms']:
+            continue
+        ratio = result['p50_ms'] / old['p50_ms']
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print("{:>6} {:>4} currencies density {:<4} planted {!s:<5} p50 x{:.2f}{}".format(*key(result), ratio, flag))
+    return regressions
+
+
+def main():
+    available = [engine for engine in ENGINES if engine != 'numpy' or np is not None]
+    parser = argparse.ArgumentParser(description="Benchmark of the bellman_ford engines")
+    parser.add_argument('--engines', nargs='+', choices=list(ENGINES), default=available)
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--densities', nargs='+', type=float, default=DENSITIES)
+    parser.add_argument('--repeats', type=int, default=REPEATS)
+    parser.add_argument('--budget', type=float, default=TIME_BUDGET, help="seconds per case")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json', help="JSON file the results are saved to")
+    parser.add_argument('--compare', help="JSON file of an earlier run to compare against")
+    args = parser.parse_args()
+    results = run(args.engines, args.sizes, args.densities, args.repeats, args.budget, args.seed)
+    report = {
+        'created': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__ if np is not None else None,
+        'machine': platform.platform(),
+        'results': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=1)
+    print("Saved {} results to {}".format(len(results), args.output))
+    if args.compare:
+        with open(args.compare) as baseline:
+            if compare(results, json.load(baseline)):
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
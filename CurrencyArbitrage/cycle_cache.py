@@ -0,0 +1,86 @@
+"""
+@author: Aishwarya Supekar
+Seattle University
+"""
+import math
+from collections import OrderedDict, defaultdict
+
+CYCLE_CACHE_SIZE = 64   # Number of arbitrage paths remembered
+
+
+class cycle_cache(object):
+    """
+    Watchlist of recently found arbitrage paths, indexed by the currency pairs they
+    trade, so a quote update only re-prices the paths which use the updated pair
+    """
+
+    def __init__(self, size=CYCLE_CACHE_SIZE):
+        self.size = size
+        self.paths = OrderedDict()           # Remembered path tuples, least recently used first
+        self.profitable = OrderedDict()      # The remembered paths which are still profitable, same order
+        self.pathsByPair = defaultdict(set)  # frozenset({currency1, currency2}) -> path tuples trading that pair
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, path):
+        """
+        Method to remember a profitable path, evicting the least recently used one when full
+        """
+        path = tuple(path)
+        if path not in self.paths:
+            for ver1, ver2 in zip(path, path[1:]):
+                self.pathsByPair[frozenset((ver1, ver2))].add(path)
+        self.paths[path] = None
+        self.paths.move_to_end(path)
+        self.profitable[path] = None
+        self.profitable.move_to_end(path)
+        while len(self.paths) > self.size:
+            self.evict(next(iter(self.paths)))
+
+    def evict(self, path):
+        """
+        Method to forget an arbitrage path
+        """
+        del self.paths[path]
+        self.profitable.pop(path, None)
+        for ver1, ver2 in zip(path, path[1:]):
+            pair = frozenset((ver1, ver2))
+            self.pathsByPair[pair].discard(path)
+            if not self.pathsByPair[pair]:
+                del self.pathsByPair[pair]
+
+    def getProfit(self, weight, path, initialInvestment):
+        """
+        Same check as bellman_ford.getProfit, reading the log rates through weight
+        @param weight function (currency1, currency2) -> log rate, inf for a missing quote
+        """
+        profit = initialInvestment
+        for start, end in zip(path, path[1:]):
+            profit = profit * math.exp(-weight(start, end))
+        return profit > initialInvestment
+
+    def reprice(self, weight, changes, money):
+        """
+        Method to re-price the remembered paths which trade one of the changed pairs
+        @param weight function (currency1, currency2) -> log rate
+        @param changes iterable of changed (currency1, currency2) edges
+        @return most recently used path which is still profitable, or None
+        """
+        repriced = set()
+        for ver1, ver2 in changes:
+            for path in self.pathsByPair.get(frozenset((ver1, ver2)), ()):
+                if path in repriced:
+                    continue
+                repriced.add(path)
+                if not self.getProfit(weight, path, money):
+                    self.profitable.pop(path, None)
+                elif path not in self.profitable:
+                    self.profitable[path] = None
+        if not self.profitable:
+            self.misses += 1
+            return None
+        self.hits += 1
+        path = next(reversed(self.profitable))
+        self.paths.move_to_end(path)
+        self.profitable.move_to_end(path)
+        return list(path)
@@ -0,0 +1,186 @@
+"""
+@author: Aishwarya Supekar
+Seattle University
+"""
+import asyncio
+import time
+from arbitrage_finder import MONEY_INVESTMENT
+from fxp_bytes_subscriber import fxp_bytes_subscriber, SUBSCRIPTION_TIME, RENEW_BEFORE, QUOTE_SIZE
+from metrics import stop_log_sink
+
+
+class fxp_datagram_protocol(asyncio.DatagramProtocol):
+    """
+    Hands every datagram received on the listener to the subscriber
+    """
+
+    def __init__(self, subscriber):
+        self.subscriber = subscriber
+
+    def datagram_received(self, data, addr):
+        self.subscriber.on_datagram(data, addr)
+
+    def error_received(self, exc):
+        print("Socket Failure %s" % (exc))
+
+
+class fxp_async_subscriber(fxp_bytes_subscriber):
+    """
+    asyncio front end of fxp_bytes_subscriber. The listener is driven by a
+    DatagramProtocol, renewal, expiry and debounced solves are loop timers, and the
+    arbitrage found is streamed by the arbitrages async generator. Several of these
+    can share one event loop, see merge_arbitrages
+    """
+
+    def __init__(self, **options):
+        """
+        @param options same keyword arguments as fxp_bytes_subscriber, including the
+        publisher servers and renew
+        """
+        super().__init__(**options)
+        self.selector.unregister(self.listener)  # the event loop owns the listener from here on
+        self.transport = None
+        self.results = asyncio.Queue()    # (path, graph of the path), None once the subscription ended
+        self._subscription_timer = None
+        self._solve_timer = None
+        self._metrics_timer = None
+
+    async def start(self):
+        """
+        Method to start receiving and send the subscription
+        """
+        loop = asyncio.get_running_loop()
+        self.transport, _protocol = await loop.create_datagram_endpoint(
+            lambda: fxp_datagram_protocol(self), sock=self.listener)
+        if self.worker is not None:
+            loop.add_reader(self.worker.results.fileno(), self.on_results)
+        self.subscribe()
+        if self.metrics.path is not None:
+            self.flush_metrics()
+
+    def flush_metrics(self):
+        """
+        Method to write the metrics file now and every metrics period
+        """
+        stats = super().flush_metrics()
+        self._metrics_timer = asyncio.get_running_loop().call_later(self.metrics.period, self.flush_metrics)
+        return stats
+
+    def subscribe(self):
+        """
+        Method to send the subscription to the publishers and schedule its renewal or expiry
+        """
+        for server in self.servers:
+            self.transport.sendto(self.serialize_address(self.listener_addr), server)
+        loop = asyncio.get_running_loop()
+        if self.renew:
+            self._subscription_timer = loop.call_later(max(0, SUBSCRIPTION_TIME - RENEW_BEFORE), self.subscribe)
+        else:
+            self._subscription_timer = loop.call_later(SUBSCRIPTION_TIME, self.close)
+
+    def on_datagram(self, data, address):
+        """
+        Method to take in one datagram and solve now or schedule the debounced solve
+        """
+        self.publisherQuotes[address] = self.publisherQuotes.get(address, 0) + len(data) // QUOTE_SIZE
+        started = time.perf_counter()
+        quotes = self.decode_quotes(data)
+        self.metrics.datagram(len(data) // QUOTE_SIZE, time.perf_counter() - started)
+        self.apply_quotes(*quotes)
+        self.add_pending(len(data) // QUOTE_SIZE)
+        self.schedule_solve()
+
+    def schedule_solve(self):
+        """
+        Method to solve the pending quotes if they are due, else to set a timer for when they will be
+        """
+        if self._solve_timer is not None:
+            self._solve_timer.cancel()
+            self._solve_timer = None
+        if self.solve_due():
+            for found in self.solve_pending():
+                self.results.put_nowait(found)
+        elif self.pendingQuotes:
+            self._solve_timer = asyncio.get_running_loop().call_later(self.next_timeout(), self.schedule_solve)
+
+    def on_results(self):
+        """
+        Method to pass on the arbitrage sent back by the worker process, and to restart it if it died
+        """
+        for found in self.worker.receive():
+            self.metrics.detected()
+            self.results.put_nowait(found)
+        if not self.worker.is_alive():
+            loop = asyncio.get_running_loop()
+            loop.remove_reader(self.worker.results.fileno())
+            self.restart_worker()
+            loop.add_reader(self.worker.results.fileno(), self.on_results)
+            self.schedule_solve()
+
+    async def arbitrages(self):
+        """
+        Async generator of the arbitrage found, as (path, graph of the path), until the
+        subscription ends
+        """
+        while True:
+            found = await self.results.get()
+            if found is None:
+                return
+            yield found
+
+    def close(self):
+        """
+        Method to stop receiving and end the arbitrages stream
+        """
+        for timer in (self._subscription_timer, self._solve_timer, self._metrics_timer):
+            if timer is not None:
+                timer.cancel()
+        if self.worker is not None:
+            asyncio.get_running_loop().remove_reader(self.worker.results.fileno())
+            self.worker.close()
+        if self.transport is not None:
+            self.transport.close()
+        if self.metrics.path is not None:
+            fxp_bytes_subscriber.flush_metrics(self)
+        if self.snapshot is not None:
+            self.snapshot.close()
+        stop_log_sink()
+        self.results.put_nowait(None)
+
+
+async def merge_arbitrages(subscribers):
+    """
+    Async generator merging the arbitrage streams of several started subscribers
+    @return (subscriber, path, graph of the path) in the order they are found
+    """
+    merged = asyncio.Queue()
+
+    async def forward(subscriber):
+        async for path, graph in subscriber.arbitrages():
+            await merged.put((subscriber, path, graph))
+        await merged.put(None)
+
+    tasks = [asyncio.create_task(forward(subscriber)) for subscriber in subscribers]
+    running = len(tasks)
+    try:
+        while running:
+            found = await merged.get()
+            if found is None:
+                running -= 1
+            else:
+                yield found
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def main():
+    subscriber = fxp_async_subscriber()
+    print("Listening on {}".format(subscriber.listener_addr))
+    await subscriber.start()
+    async for path, graph in subscriber.arbitrages():
+        subscriber.bellmanFord.printArbitrage(graph, path, MONEY_INVESTMENT)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -4,28 +4,114 @@
 Seattle University
 """
 
+import logging
+import os
 import socket
+import struct
 from array import array
 import selectors
+import time
 from datetime import datetime, timedelta
-import math
-from collections import defaultdict
+from arbitrage_finder import (arbitrage_finder, MONEY_INVESTMENT, SOLVER_ENGINE, INCREMENTAL_SOLVE, QUOTE_TTL,
+                              CYCLE_CACHE)
 from bellman_ford import bellman_ford
+from metrics import pipeline_metrics, start_log_sink, stop_log_sink, LOGGER
+from quote_snapshot import quote_snapshot
+from quote_store import quote_store
+from solver_process import solver_process
 
 server_address = ('cs2.seattleu.edu', 50303)  # Address of the Provider
-liveForexData = {}                            # Ditionary to store the live feed
 BUZ_FEED = 4096                               # Buffer size
+RECEIVE_BUFFER = 4 * 1024 * 1024              # SO_RCVBUF of the listener in bytes, None for the system default
+QUOTE_SIZE = 32                               # Bytes per quote record
+QUOTE_HEADER = struct.Struct('>Q6s18x')       # Quote timestamp (big-endian microseconds) and currency pair
+QUOTE_RATE = struct.Struct('<14xd10x')        # Quote conversion rate (little-endian double)
 SUBSCRIPTION_TIME = 10 * 60                   # Subscription time in seconds
-MONEY_INVESTMENT = 100.00                     # $ 100 investment for the currency conversion profit
+RENEW_BEFORE = 30                             # Seconds before the subscription expires to renew it
+RENEW_SUBSCRIPTION = True                     # Renew the subscription instead of stopping when it expires
+SOLVE_WINDOW = 0.005                          # Seconds without new quotes before the pending ones are solved
+SOLVE_QUOTES = 500                            # Pending quotes which trigger a solve without waiting for the window
+MAX_SOLVE_DELAY = 0.05                        # Longest time in seconds a quote waits for a solve during a burst
+IDLE_TIMEOUT = 0.2                            # Selector timeout in seconds when nothing is pending
+PIPELINED_SOLVE = False                       # Solve in a worker process so receiving never waits for the solver
+QUOTE_SNAPSHOT = 'fxp_quotes.snapshot'        # Memory-mapped quote file for warm restarts, None to run without
+METRICS_FILE = 'fxp_metrics_{port}.json'      # Pipeline metrics file of each listener port, None to keep them in memory
+LOG_LEVEL = logging.INFO                      # logging.DEBUG to also log every quote received
+
+logger = logging.getLogger(LOGGER)
 
 class fxp_bytes_subscriber(object):
 
-    def __init__(self):
+    def __init__(self, engine=SOLVER_ENGINE, incremental=INCREMENTAL_SOLVE, ttl=QUOTE_TTL, cache=CYCLE_CACHE,
+                 window=SOLVE_WINDOW, maxQuotes=SOLVE_QUOTES, maxDelay=MAX_SOLVE_DELAY, pipelined=PIPELINED_SOLVE,
+                 servers=(server_address,), renew=RENEW_SUBSCRIPTION, snapshot=QUOTE_SNAPSHOT,
+                 metrics=METRICS_FILE, logLevel=LOG_LEVEL):
+        """
+        @param servers addresses of the publishers to subscribe to, their feeds are merged
+        per currency pair keeping the newest quote
+        @param renew renew the subscription before it expires instead of stopping
+        @param snapshot path of the quote snapshot file, None to run without one, as does a
+        subscriber finding it written by another one
+        @param metrics path of the metrics file, {port} is replaced by the listener port so
+        that subscribers do not overwrite each other's file, None to keep the metrics in memory
+        @param logLevel level of the log sink, logging.DEBUG logs every quote
+        """
+        self.metrics = pipeline_metrics()  # Its path is known once the listener is bound
+        self.ttl = ttl
+        self.servers = list(servers)
+        self.renew = renew
+        self.publisherQuotes = {}     # Publisher address -> number of quotes received from it
+        if pipelined:
+            self.finder = None
+            self.quotes = quote_store()   # Only filters out-of-sequence quotes, the worker keeps its own
+            self.worker = solver_process(engine, incremental, ttl, cache, logLevel=logLevel)
+        else:
+            self.finder = arbitrage_finder(engine, incremental, ttl, cache, self.metrics)
+            self.quotes = self.finder.quotes  # Live feed of this subscriber
+            self.worker = None
+        start_log_sink(logLevel)          # After the worker is forked, its thread is not forked along
+        self.outbox = {}              # Quotes accepted since the last snapshot sent to the worker
+        self.window = window
+        self.maxQuotes = maxQuotes
+        self.maxDelay = maxDelay
+        self.pendingQuotes = 0        # Quotes received since the last solve
+        self._pending_since = None    # time.monotonic() of the oldest of those quotes
+        self._received_at = None      # time.monotonic() of the newest of those quotes
         self.selector = selectors.DefaultSelector()
         self._started_at = datetime.utcnow()
+        self.buffer = bytearray(BUZ_FEED)         # Every datagram is received into this one buffer
+        self.bufferView = memoryview(self.buffer)
         self.listener, self.listener_addr = self.start_server()
         self.selector.register(self.listener, selectors.EVENT_READ)
+        if metrics is not None:
+            self.metrics.path = metrics.format(port=self.listener_addr[1])
+        if self.worker is not None:
+            self.selector.register(self.worker.results, selectors.EVENT_READ)
         self.bellmanFord = bellman_ford()
+        self.snapshot = None
+        if snapshot is not None:
+            try:
+                self.snapshot = quote_snapshot(snapshot)
+            except BlockingIOError as err:
+                print("Running without a quote snapshot: %s" % (err.strerror))
+        if self.snapshot is not None:
+            self.load_snapshot(ttl)
+
+    def load_snapshot(self, ttl):
+        """
+        Method to warm up the live feed with the quotes of the snapshot which are
+        still within the ttl, they are solved with the first quotes received
+        """
+        now = int(time.time() * 1000000)
+        loaded = 0
+        for microSeconds, pair, convRate in self.snapshot.quotes(ttl, now):
+            if self.quotes.update(microSeconds, pair, convRate):
+                if self.worker is not None:
+                    self.outbox[pair] = (microSeconds, convRate)
+                loaded += 1
+        if loaded:
+            print("Loaded {} quotes from {}".format(loaded, self.snapshot.path))
+            self.add_pending(loaded)
 
     def serialize_address(self, ip_port : (str,int)) -> (bytes):
         """
@@ -46,7 +132,10 @@ class fxp_bytes_subscriber(object):
         Method to create listening server
         """
         listener = socket.socket(socket.AF_INET , socket.SOCK_DGRAM)
+        if RECEIVE_BUFFER is not None:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
         listener.bind(('localhost',0))
+        listener.setblocking(False)
         listener_addr = listener.getsockname()
         return listener, listener_addr
 
@@ -55,78 +144,242 @@ class fxp_bytes_subscriber(object):
         Method to keep listening for data
         """
         #print('waiting for data on {}'.format(self.listener_addr))
-        next_timeout = 0.2  # FIXME
         while InComingData:
-            events = self.selector.select(next_timeout)
+            events = self.selector.select(self.next_timeout())
             for key, mask in events:
-                if mask & selectors.EVENT_READ:
-                    data = self.read_data()
-                    if data:
-                        graph = self.generate_graph()
-                        self.bellmanFord.findArbitartion(graph,'USD', MONEY_INVESTMENT)
-                    else:
+                if key.fileobj == self.listener:
+                    if not self.drain():
                         print("No data received")
+                else:
+                    for path, graph in self.worker.receive():
+                        self.metrics.detected()
+                        self.bellmanFord.printArbitrage(graph, path, MONEY_INVESTMENT)
+                    if not self.worker.is_alive():
+                        self.restart_worker()
+            if self.solve_due():
+                for path, graph in self.solve_pending():
+                    self.bellmanFord.printArbitrage(graph, path, MONEY_INVESTMENT)
+            if self.metrics.flush_due():
+                self.flush_metrics()
             InComingData = self.check_subscribtion_expired()
 
+    def solve_pending(self):
+        """
+        Method to solve the pending quotes, or in pipelined mode hand them to the worker
+        @return list of (path, graph of the path) found right away
+        """
+        self.pendingQuotes = 0
+        self._pending_since = self._received_at = None
+        if self.worker is not None:
+            self.quotes.dirty.clear()
+            self.worker.submit(self.outbox)
+            self.outbox = {}
+            return []
+        self.finder.expire_quotes()
+        path = self.finder.find_arbitrage()
+        if path:
+            self.metrics.detected()
+            return [(path, self.finder.path_graph(path))]
+        return []
+
+    def restart_worker(self):
+        """
+        Method to replace a worker process which died, handing the new one the whole live feed
+        """
+        self.selector.unregister(self.worker.results)
+        print("Solver process exited with code {}, restarted it".format(self.worker.restart()))
+        self.selector.register(self.worker.results, selectors.EVENT_READ)
+        self.outbox = {pair: (microSeconds, convRate) for microSeconds, pair, convRate in self.quotes.quotes()}
+        self.add_pending(len(self.outbox))
+
+    def flush_metrics(self):
+        """
+        Method to write the metrics file, along with the receive and publisher counters
+        """
+        publishers = {"{}:{}".format(*address): quotes for address, quotes in self.publisherQuotes.items()}
+        return self.metrics.write({'receive': self.receive_stats(), 'publishers': publishers})
+
+    def drain(self):
+        """
+        Method to read every datagram already queued on the listener, stopping early when
+        enough quotes are pending or the oldest one waited too long, so a steady feed
+        does not hold the solve back
+        @return number of quotes read
+        """
+        quotes = 0
+        while self.listener.fileno() >= 0:
+            data = self.read_data()
+            if not data:
+                break
+            quotes += len(data) // QUOTE_SIZE
+            self.add_pending(len(data) // QUOTE_SIZE)
+            if self.pendingQuotes and (self.pendingQuotes >= self.maxQuotes
+                                       or time.monotonic() - self._pending_since >= self.maxDelay):
+                break
+        return quotes
+
+    def add_pending(self, quotes):
+        """
+        Method to count freshly received quotes towards the next solve
+        """
+        if quotes:
+            now = time.monotonic()
+            if self._pending_since is None:
+                self._pending_since = now
+            self._received_at = now
+            self.pendingQuotes += quotes
+
+    def solve_due(self):
+        """
+        Method to check if the pending quotes should be solved now: the feed has been
+        quiet for the window, enough quotes piled up, or the oldest one waited too long
+        """
+        if not self.pendingQuotes:
+            return False
+        now = time.monotonic()
+        return (self.pendingQuotes >= self.maxQuotes or now - self._received_at >= self.window
+                or now - self._pending_since >= self.maxDelay)
+
+    def next_timeout(self):
+        """
+        Method to work out how long the selector may wait before a pending solve is due
+        """
+        if not self.pendingQuotes:
+            return IDLE_TIMEOUT
+        now = time.monotonic()
+        due = min(self._received_at + self.window, self._pending_since + self.maxDelay)
+        return max(0, min(IDLE_TIMEOUT, due - now))
+
     def read_data(self):
         """
-        Method to accept data from the Publisher
+        Method to accept one datagram from the Publisher, if there is one waiting
+        @return the datagram (a view of the receive buffer), empty if nothing was waiting
         """
+        data = b''
         try:
-            
-            data, _address = self.listener.recvfrom(BUZ_FEED)
-            #print("Received {} bytes". format(len(data)))
-            
-            start = 0
-            end = 32
-            remaining = len(data)
-            while remaining > 0 :
-                self.deserialize_data(data[start:end])
-                start = end
-                end = start + 32
-                remaining = remaining - 32
-            self.listener.settimeout(5)
+            size, address = self.listener.recvfrom_into(self.buffer)
+            #print("Received {} bytes". format(size))
+            data = self.bufferView[:size]
+            self.publisherQuotes[address] = self.publisherQuotes.get(address, 0) + size // QUOTE_SIZE
+            started = time.perf_counter()
+            quotes = self.decode_quotes(data)
+            self.metrics.datagram(size // QUOTE_SIZE, time.perf_counter() - started)
+            self.apply_quotes(*quotes)
+        except BlockingIOError:
+            pass
         except socket.error as err:
             print("Socket Failure %s"%(err))
+            self.selector.unregister(self.listener)
             self.listener.close()
 
         return data
 
+    def receive_stats(self):
+        """
+        Method to read the receive buffer size and the kernel drop counters, where Linux
+        exposes them: drops of this socket from /proc/net/udp, and the system wide
+        receive buffer overruns from /proc/net/snmp
+        @return dictionary, counters which are not available are None
+        """
+        stats = {'rcvbuf': None, 'drops': None, 'overruns': None}
+        if self.listener.fileno() < 0:
+            return stats
+        stats['rcvbuf'] = self.listener.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        inode = str(os.fstat(self.listener.fileno()).st_ino)
+        try:
+            with open('/proc/net/udp') as udp:
+                for line in udp:
+                    fields = line.split()
+                    if len(fields) > 12 and fields[9] == inode:
+                        stats['drops'] = int(fields[12])
+            with open('/proc/net/snmp') as snmp:
+                udp = [line.split() for line in snmp if line.startswith('Udp:')]
+            if len(udp) == 2 and 'RcvbufErrors' in udp[0]:
+                stats['overruns'] = int(udp[1][udp[0].index('RcvbufErrors')])
+        except OSError:
+            pass
+        return stats
+
     def generate_graph(self):
         """
         Method to generate graph from the recived live data
         @return graph
         """
-        graph = defaultdict(dict)
-        for key , values in liveForexData.items():
-            cur1, cur2 = key.split(" ")
-            time , curRate = values
-            graph[cur1][cur2] = float(-math.log(float(curRate)))
-            graph[cur2][cur1] = float(math.log(float(curRate)))
-        return graph
+        return self.quotes.graph()
+
+    def decode_quotes(self, data):
+        """
+        Method to decode every quote record of a datagram in one go, reading it through
+        a memoryview with the precompiled record layouts (no per record slicing)
+        @param data datagram in bytes
+        @return timestamps, currency pairs (6 ascii bytes each), conversion rates
+        """
+        view = memoryview(data)[:len(data) - len(data) % QUOTE_SIZE]
+        if not view:
+            return (), (), ()
+        timestamps, pairs = zip(*QUOTE_HEADER.iter_unpack(view))
+        rates = [rate for rate, in QUOTE_RATE.iter_unpack(view)]
+        return timestamps, pairs, rates
+
+    def apply_quotes(self, timestamps, pairs, rates):
+        """
+        Method to store a batch of decoded quotes in the live feed
+        """
+        if not timestamps:
+            return
+        newest = max(timestamps)
+        if newest > self.metrics.newestQuote:
+            self.metrics.newestQuote = newest
+        if self.ttl is not None:
+            oldest = time.time() * 1000000 - self.ttl * 1000000
+            self.metrics.stale += sum(1 for microSeconds in timestamps if microSeconds < oldest)
+        for microSeconds, pair, convRate in zip(timestamps, pairs, rates):
+            self.apply_quote(microSeconds, pair, convRate)
 
     def deserialize_data(self,data):
         """
         Method to deserialize the quote
         @param data in bytes
         """
-        currencyToCurrency = self.getCurreny(data[8:14])
         microSeconds = self.getMicroSeconds(data[0:8])
         convRate = self.getConvRate(data[14:22])
+        self.apply_quote(microSeconds, bytes(data[8:14]), convRate)
+
+    def apply_quote(self, microSeconds, pair, convRate):
+        """
+        Method to store one quote, keeping the newest one for every currency pair
+        @param pair currency pair as 6 ascii bytes
+        """
         # check if exists whtr to override or keep
-        convertToUtcDate = self.convertToUtcDate(microSeconds)
-        if (currencyToCurrency in liveForexData):
-            microSecondsOld, convRateOld = liveForexData[currencyToCurrency]
-            if(microSecondsOld < microSeconds):
-                print("removing stale quote for", currencyToCurrency)
-                print(convertToUtcDate, currencyToCurrency, convRate)
-                liveForexData[currencyToCurrency] = (microSeconds, convRate)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            convertToUtcDate = self.convertToUtcDate(microSeconds)
+            currencyToCurrency = self.quotes.pair_name(pair)
+        if self.quotes.has_quote(pair):
+            if self.quotes.update(microSeconds, pair, convRate):
+                self.accept_quote(microSeconds, pair, convRate)
+                if debug:
+                    logger.debug("removing stale quote for %s", currencyToCurrency)
+                    logger.debug("%s %s %s", convertToUtcDate, currencyToCurrency, convRate)
             else:
-                print(convertToUtcDate , currencyToCurrency, convRate)
-                print("ignoring out-of-sequence message")
+                self.metrics.outOfSequence += 1
+                if debug:
+                    logger.debug("%s %s %s", convertToUtcDate, currencyToCurrency, convRate)
+                    logger.debug("ignoring out-of-sequence message")
         else :
-            liveForexData[currencyToCurrency] = (microSeconds, convRate)
-            print(convertToUtcDate, currencyToCurrency, convRate)
+            self.quotes.update(microSeconds, pair, convRate)
+            self.accept_quote(microSeconds, pair, convRate)
+            if debug:
+                logger.debug("%s %s %s", convertToUtcDate, currencyToCurrency, convRate)
+
+    def accept_quote(self, microSeconds, pair, convRate):
+        """
+        Method to pass a quote stored in the live feed on to the worker and the snapshot
+        """
+        if self.worker is not None:
+            self.outbox[pair] = (microSeconds, convRate)
+        if self.snapshot is not None:
+            self.snapshot.record(microSeconds, pair, convRate)
 
     def getConvRate(self, convRateInBytes):
         """
@@ -169,28 +422,49 @@ class fxp_bytes_subscriber(object):
     
     def check_subscribtion_expired(self):
         """
-        Method to check if the subscription has expired
+        Method to check if the subscription has expired. With renew set the subscription
+        is renewed RENEW_BEFORE seconds ahead, from the same listener, so no quote is missed.
+        A listener closed by a socket failure ends the subscription, renewing it is no use
+        @return False once the subscription ended
         """
+        if self.listener.fileno() < 0:
+            print("Listener closed, ending the subscription")
+            self.end_subscription()
+            return False
         time_passed = datetime.utcnow() - self._started_at
+        if self.renew and time_passed.total_seconds() > SUBSCRIPTION_TIME - RENEW_BEFORE:
+            print("Renewing Subscription")
+            self.subscribe_renew()
+            return True
         if time_passed.total_seconds() > SUBSCRIPTION_TIME :
-#            print("Renewing Subscription")
-#            self.subscribe_renew()
-#            return True
-            #uncomment above 3 line and comment bleow 4 lines
-            # if the program is needed to to renew subscription
             print("Subscribtion expired...")
-            self.selector.unregister(self.listener)
-            self.listener.close()
+            self.end_subscription()
             return False
         return True
+
+    def end_subscription(self):
+        """
+        Method to write out the last metrics and release the listener, worker and snapshot
+        """
+        print("Receive stats:", self.receive_stats())
+        self.flush_metrics()
+        if self.listener.fileno() >= 0:
+            self.selector.unregister(self.listener)
+            self.listener.close()
+        if self.worker is not None:
+            self.selector.unregister(self.worker.results)
+            self.worker.close()
+        if self.snapshot is not None:
+            self.snapshot.close()
+        stop_log_sink()
             
     def subscribe_renew(self):
         """
-        Method to subscribe or renew subscribtion
+        Method to subscribe or renew subscribtion with every publisher
         """
         with socket.socket(socket.AF_INET , socket.SOCK_DGRAM) as conn:
-            conn.connect (server_address)
-            conn.send(self.serialize_address(self.listener_addr))
+            for server in self.servers:
+                conn.sendto(self.serialize_address(self.listener_addr), server)
         self._started_at = datetime.utcnow()
 
 
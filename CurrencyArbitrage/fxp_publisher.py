@@ -0,0 +1,223 @@
+"""
+@author: Aishwarya Supekar
+Seattle University
+"""
+import argparse
+import math
+import random
+import selectors
+import socket
+import struct
+import time
+from fxp_bytes_subscriber import BUZ_FEED, QUOTE_SIZE, SUBSCRIPTION_TIME
+
+QUOTE_STAMP = struct.Struct('>Q6s')           # Quote timestamp (big-endian microseconds) and currency pair
+QUOTE_RATE = struct.Struct('<d')              # Quote conversion rate (little-endian double), at byte 14
+SUBSCRIPTION = struct.Struct('>4sH')          # Subscriber IP address bytes and big-endian port
+CURRENCIES = ['USD', 'EUR', 'GBP', 'JPY', 'CHF', 'CAD', 'AUD', 'NZD', 'SEK', 'NOK']
+QUOTES_PER_SECOND = 1000                      # Quotes sent to every subscriber per second
+BURST = 10                                    # Quotes sent together, split into datagrams of up to BUZ_FEED bytes
+OUT_OF_ORDER = 0.01                           # Probability a quote is sent with an older timestamp
+DUPLICATE = 0.01                              # Probability a quote is sent twice
+PLANTED_CYCLES = 1                            # Number of three currency arbitrage cycles planted in the quotes
+CYCLE_PROFIT = 0.01                           # Profit of a planted cycle, 0.01 for 1%
+VOLATILITY = 0.0                             # Standard deviation of the price random walk per burst
+
+
+class fxp_publisher(object):
+    """
+    Local stand-in for the forex provider, speaking the same protocol: subscriptions
+    are 6 byte datagrams made by fxp_bytes_subscriber.serialize_address and quotes are
+    sent as 32 byte records. Every quote is priced from one set of currency prices,
+    so the only arbitrage is in the cycles planted on purpose. With a volatility the
+    prices take a random walk step between bursts; the subscriber's graph then mixes
+    quotes of different steps, which brings arbitrage nobody planted
+    """
+
+    def __init__(self, address=('localhost', 0), currencies=len(CURRENCIES), rate=QUOTES_PER_SECOND, burst=BURST,
+                 outOfOrder=OUT_OF_ORDER, duplicate=DUPLICATE, cycles=PLANTED_CYCLES, profit=CYCLE_PROFIT,
+                 seed=None, volatility=VOLATILITY):
+        """
+        @param currencies number of currencies quoted, all pairs between them are quoted
+        @param rate quotes per second sent to every subscriber
+        @param burst quotes sent together
+        @param outOfOrder probability of sending a quote with an older timestamp
+        @param duplicate probability of sending a quote twice
+        @param cycles number of arbitrage cycles to plant
+        @param profit profit of every planted cycle
+        @param volatility standard deviation of the price random walk per burst, 0 for fixed prices
+        """
+        self.random = random.Random(seed)
+        self.currencies = self.currency_names(currencies)
+        self.prices = {currency: math.exp(self.random.gauss(0, 1)) for currency in self.currencies}
+        self.pairs = [(cur1, cur2) for i, cur1 in enumerate(self.currencies) for cur2 in self.currencies[i + 1:]]
+        self.rate = rate
+        self.burst = burst
+        self.outOfOrder = outOfOrder
+        self.duplicate = duplicate
+        self.volatility = volatility
+        self.planted = []             # Planted cycles, as paths like ['USD', 'EUR', 'GBP', 'USD']
+        self.inflated = {}            # Quoted pair -> rate factor making its cycle profitable
+        self.plant_cycles(cycles, profit)
+        self.subscribers = {}         # Subscriber address -> time.monotonic() its subscription expires
+        self.sent = 0                 # Quotes sent, counted once per subscriber
+        self.buffer = bytearray(BUZ_FEED - BUZ_FEED % QUOTE_SIZE)
+        self.selector = selectors.DefaultSelector()
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.bind(address)
+        self.server.setblocking(False)
+        self.address = self.server.getsockname()
+        self.selector.register(self.server, selectors.EVENT_READ)
+
+    def currency_names(self, count):
+        """
+        Method to name the currencies, the real codes first and made up ones after
+        """
+        names = CURRENCIES[:count]
+        letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+        for number in range(max(0, count - len(CURRENCIES))):
+            names.append('X' + letters[number // 26 % 26] + letters[number % 26])
+        return names
+
+    def plant_cycles(self, cycles, profit):
+        """
+        Method to pick currency triangles and inflate one rate of each, so that trading
+        round the triangle earns the profit. Every triangle gets a pair of its own
+        @raises ValueError if there are not enough currencies for the cycles
+        """
+        if not cycles:
+            return
+        room = len(self.currencies) * (len(self.currencies) - 1) // 2 if len(self.currencies) >= 3 else 0
+        if cycles > room:
+            raise ValueError("%d currencies leave room for %d planted cycles, not %d"
+                             % (len(self.currencies), room, cycles))
+        candidates = [(cur1, cur2) for i, cur1 in enumerate(self.currencies) for cur2 in self.currencies[i + 1:]]
+        for cur1, cur2 in self.random.sample(candidates, cycles):
+            if self.random.random() < 0.5:
+                cur1, cur2 = cur2, cur1
+            cur3 = self.random.choice([currency for currency in self.currencies if currency not in (cur1, cur2)])
+            self.pairs = [pair for pair in self.pairs if pair != (cur2, cur1)]
+            if (cur1, cur2) not in self.pairs:
+                self.pairs.append((cur1, cur2))
+            self.inflated[(cur1, cur2)] = 1 + profit
+            self.planted.append([cur1, cur2, cur3, cur1])
+
+    def move_prices(self):
+        """
+        Method to take one random walk step of every price, between two bursts
+        """
+        if self.volatility:
+            for currency in self.prices:
+                self.prices[currency] *= math.exp(self.random.gauss(0, self.volatility))
+
+    def quote(self, now):
+        """
+        Method to make the next quote from the current prices
+        @return list of (timestamp, currency pair as 6 ascii bytes, conversion rate) to send
+        """
+        cur1, cur2 = self.random.choice(self.pairs)
+        convRate = self.prices[cur2] / self.prices[cur1] * self.inflated.get((cur1, cur2), 1)
+        microSeconds = int(now * 1000000)
+        if self.random.random() < self.outOfOrder:
+            microSeconds -= self.random.randint(1, 1000000)
+        quote = (microSeconds, (cur1 + cur2).encode('ascii'), convRate)
+        if self.random.random() < self.duplicate:
+            return [quote, quote]
+        return [quote]
+
+    def subscribe(self, data):
+        """
+        Method to register or renew a subscriber from its subscription datagram
+        """
+        if len(data) != SUBSCRIPTION.size:
+            print("Ignoring subscription of {} bytes".format(len(data)))
+            return
+        ip, port = SUBSCRIPTION.unpack(data)
+        address = ('.'.join(str(byte) for byte in ip), port)
+        if address not in self.subscribers:
+            print("Subscribed {}".format(address))
+        self.subscribers[address] = time.monotonic() + SUBSCRIPTION_TIME
+
+    def publish(self, quotes):
+        """
+        Method to send a burst of quotes to every subscriber
+        """
+        now = time.monotonic()
+        for address in [address for address, expiry in self.subscribers.items() if expiry < now]:
+            print("Subscription of {} expired".format(address))
+            del self.subscribers[address]
+        perDatagram = len(self.buffer) // QUOTE_SIZE
+        for start in range(0, len(quotes), perDatagram):
+            chunk = quotes[start:start + perDatagram]
+            for number, (microSeconds, pair, convRate) in enumerate(chunk):
+                QUOTE_STAMP.pack_into(self.buffer, number * QUOTE_SIZE, microSeconds, pair)
+                QUOTE_RATE.pack_into(self.buffer, number * QUOTE_SIZE + 14, convRate)
+            datagram = memoryview(self.buffer)[:len(chunk) * QUOTE_SIZE]
+            for address in self.subscribers:
+                try:
+                    self.server.sendto(datagram, address)
+                    self.sent += len(chunk)
+                except BlockingIOError:
+                    pass                # Dropped, like any UDP datagram can be
+                except OSError as err:
+                    print("Socket Failure %s" % (err))
+
+    def run_forever(self, duration=None):
+        """
+        Method to take subscriptions and send a burst every burst / rate seconds
+        @param duration seconds to run for, None to run until interrupted
+        """
+        interval = self.burst / self.rate
+        started = nextBurst = time.monotonic()
+        while duration is None or time.monotonic() - started < duration:
+            for key, mask in self.selector.select(max(0, nextBurst - time.monotonic())):
+                while True:
+                    try:
+                        data, _address = self.server.recvfrom(BUZ_FEED)
+                    except BlockingIOError:
+                        break
+                    self.subscribe(data)
+            now = time.monotonic()
+            if now >= nextBurst:
+                if self.subscribers:
+                    self.move_prices()
+                    quotes = []
+                    wallClock = time.time()
+                    while len(quotes) < self.burst:
+                        quotes.extend(self.quote(wallClock + len(quotes) / 1000000))  # one microsecond apart
+                    self.publish(quotes)
+                nextBurst = max(nextBurst + interval, now - interval)
+
+    def close(self):
+        self.selector.close()
+        self.server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic forex quote publisher")
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--currencies', type=int, default=len(CURRENCIES))
+    parser.add_argument('--rate', type=float, default=QUOTES_PER_SECOND, help="quotes per second")
+    parser.add_argument('--burst', type=int, default=BURST, help="quotes sent together")
+    parser.add_argument('--out-of-order', type=float, default=OUT_OF_ORDER)
+    parser.add_argument('--duplicate', type=float, default=DUPLICATE)
+    parser.add_argument('--cycles', type=int, default=PLANTED_CYCLES, help="arbitrage cycles to plant")
+    parser.add_argument('--profit', type=float, default=CYCLE_PROFIT)
+    parser.add_argument('--volatility', type=float, default=VOLATILITY, help="price random walk step per burst")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    publisher = fxp_publisher(('localhost', args.port), args.currencies, args.rate, args.burst, args.out_of_order,
+                              args.duplicate, args.cycles, args.profit, args.seed, args.volatility)
+    print("Publishing on {}".format(publisher.address))
+    for path in publisher.planted:
+        print("Planted cycle", " -> ".join(path))
+    try:
+        publisher.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        publisher.close()
+
+
+if __name__ == '__main__':
+    main()
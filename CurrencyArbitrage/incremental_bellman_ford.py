@@ -0,0 +1,135 @@
+"""
+@author: Aishwarya Supekar
+Seattle University
+"""
+from collections import defaultdict, deque
+from bellman_ford import bellman_ford, TOLERANCE
+
+
+class incremental_bellman_ford(bellman_ford):
+    """
+    Arbitrage detector which keeps the shortest paths of the previous solve and
+    only re-relaxes the part of the graph affected by the changed edges
+    """
+
+    def __init__(self):
+        self.graph = defaultdict(dict)       # Graph owned by the detector, updated in place
+        self.incoming = defaultdict(set)     # Reverse adjacency, vertex -> vertices with an edge into it
+        self.children = defaultdict(set)     # Shortest path tree, vertex -> vertices it is predecessor of
+        self.distanceFromNode = {}
+        self.predecessorNode = {}
+        self.source = None
+        self.needsFullSolve = True           # Set when the stored distances can not be trusted any more
+
+    def update(self, changes, source, money):
+        """
+        Method to apply changed edges and look for arbitrage
+        @param changes dictionary of (currency1, currency2) -> new log rate, inf to remove the edge
+        @return Path with arbitrage or None
+        """
+        invalidated = set()
+        queue = deque()
+        for (ver1, ver2), weight in changes.items():
+            oldWeight = self.graph[ver1].get(ver2)
+            if weight == float("Inf"):
+                self.graph[ver1].pop(ver2, None)
+                self.incoming[ver2].discard(ver1)
+            else:
+                self.graph[ver1][ver2] = weight
+                self.incoming[ver2].add(ver1)
+            for vertex in (ver1, ver2):
+                if vertex not in self.distanceFromNode:
+                    self.distanceFromNode[vertex] = float("Inf")
+                    self.predecessorNode[vertex] = None
+            if oldWeight is not None and weight > oldWeight + TOLERANCE and self.predecessorNode[ver2] == ver1:
+                invalidated.add(ver2)
+            elif self.distanceFromNode[ver1] + weight < self.distanceFromNode[ver2] - TOLERANCE:
+                queue.append(ver1)
+        if self.needsFullSolve or source != self.source:
+            return self.fullSolve(source, money)
+        if invalidated:
+            subtree = set()
+            for vertex in invalidated:
+                subtree |= self.collectSubtree(self.children, vertex)
+            if source in subtree or 2 * len(subtree) > len(self.distanceFromNode):
+                return self.fullSolve(source, money)
+            self.resetSubtree(subtree, queue)
+        return self.propagate(queue, money)
+
+    def fullSolve(self, source, money):
+        """
+        Method to recompute all the shortest paths from the source
+        @return Path with arbitrage or None
+        """
+        self.source = source
+        self.needsFullSolve = False
+        self.children.clear()
+        for vertex in self.distanceFromNode:
+            self.distanceFromNode[vertex] = float("Inf")
+            self.predecessorNode[vertex] = None
+        self.distanceFromNode[source] = 0
+        self.predecessorNode[source] = None
+        return self.propagate(deque([source]), money)
+
+    def resetSubtree(self, subtree, queue):
+        """
+        Method to drop the distances of an invalidated subtree and re-seed it from the
+        vertices outside of it
+        """
+        for vertex in subtree:
+            self.setPredecessor(vertex, None)
+            self.distanceFromNode[vertex] = float("Inf")
+        for vertex in subtree:
+            for ver1 in self.incoming[vertex]:
+                if ver1 not in subtree:
+                    queue.append(ver1)
+
+    def setPredecessor(self, vertex, predecessor):
+        """
+        Method to update the predecessor and keep the tree children in sync
+        """
+        old = self.predecessorNode[vertex]
+        if old is not None:
+            self.children[old].discard(vertex)
+        if predecessor is not None:
+            self.children[predecessor].add(vertex)
+        self.predecessorNode[vertex] = predecessor
+
+    def isAncestor(self, vertex, descendant):
+        """
+        Method to check if vertex is on the shortest path tree path to descendant
+        """
+        steps = 0
+        while descendant is not None and steps <= len(self.predecessorNode):
+            if descendant == vertex:
+                return True
+            descendant = self.predecessorNode[descendant]
+            steps += 1
+        return False
+
+    def propagate(self, queue, money):
+        """
+        Method to relax edges out of the queued vertices until nothing changes
+        @return Path with arbitrage if a negative cycle closes, else None
+        """
+        queued = set(queue)
+        while queue:
+            ver1 = queue.popleft()
+            queued.discard(ver1)
+            if self.distanceFromNode[ver1] == float("Inf"):
+                continue
+            for ver2, weight in self.graph[ver1].items():
+                distance = self.distanceFromNode[ver1] + weight
+                if distance < self.distanceFromNode[ver2] - TOLERANCE:
+                    if self.isAncestor(ver2, ver1):
+                        self.needsFullSolve = True
+                        path = self.cyclePath(self.graph, self.predecessorNode, self.source, ver2, ver1)
+                        if path and self.getProfit(self.graph, self.source, path, money):
+                            return path
+                        return None
+                    self.distanceFromNode[ver2] = distance
+                    self.setPredecessor(ver2, ver1)
+                    if ver2 not in queued:
+                        queued.add(ver2)
+                        queue.append(ver2)
+        return None
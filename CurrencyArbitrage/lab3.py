@@ -3,7 +3,8 @@
 @author: Aishwarya Supekar
 Seattle University
 """
-from fxp_bytes_subscriber import fxp_bytes_subscriber
+import sys
+from fxp_bytes_subscriber import fxp_bytes_subscriber, server_address
 
 class Lab3:
     
@@ -14,7 +15,9 @@ class Lab3:
 
 if __name__ == '__main__':
     Lab3.welcome()
-    subscriber = fxp_bytes_subscriber()                         # Creating object for the fxp_bytes_subscriber class
+    # Publishers can be given as "host port" pairs, e.g. a local fxp_publisher, else the Provider is used
+    servers = [(host, int(port)) for host, port in zip(sys.argv[1::2], sys.argv[2::2])] or [server_address]
+    subscriber = fxp_bytes_subscriber(servers=servers)          # Creating object for the fxp_bytes_subscriber class
     print("Listening on {}".format(subscriber.listener_addr))
     subscriber.subscribe_renew()                                # Registering subscription with the Publisher
     subscriber.run_forever(True)                                    # calling the listener 
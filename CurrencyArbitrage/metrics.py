@@ -0,0 +1,216 @@
+"""
+@author: Aishwarya Supekar
+Seattle University
+"""
+import bisect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+LOGGER = 'fxp'                                # Logger of the per-quote lines, written by the log sink thread
+METRICS_PERIOD = 5.0                          # Seconds between two writes of the metrics file
+LATENCY_BOUNDS = [0.00001 * 2 ** i for i in range(24)]  # Histogram bucket upper bounds, 10 microseconds to ~84 s
+
+_sink = None            # QueueListener of the log sink once started
+_sink_users = 0         # start_log_sink calls not matched by a stop_log_sink yet
+
+
+class histogram(object):
+    """
+    Fixed bucket histogram of durations in seconds, cheap enough to fill on the hot path
+    """
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # Last bucket holds everything above the last bound
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, share):
+        """
+        Method to estimate a percentile by the upper bound of the bucket it falls in
+        """
+        rank = share * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.max, self.bounds[bucket]) if bucket < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        """
+        @return dictionary of count, mean and percentiles in milliseconds
+        """
+        if not self.count:
+            return {'count': 0}
+        return {'count': self.count, 'mean_ms': 1000 * self.total / self.count,
+                'p50_ms': 1000 * self.percentile(0.50), 'p90_ms': 1000 * self.percentile(0.90),
+                'p99_ms': 1000 * self.percentile(0.99), 'max_ms': 1000 * self.max}
+
+
+class pipeline_metrics(object):
+    """
+    Counters and histograms of the quote to arbitrage pipeline, written as JSON to a
+    metrics file every period seconds for dashboards to poll
+    """
+
+    def __init__(self, path=None, period=METRICS_PERIOD):
+        """
+        @param path metrics file, None to only keep the metrics in memory
+        """
+        self.path = path
+        self.period = period
+        self.quotes = 0               # Quotes received
+        self.datagrams = 0            # Datagrams received
+        self.outOfSequence = 0        # Quotes ignored because a newer one was stored already
+        self.stale = 0                # Quotes older than the ttl when they arrived
+        self.expired = 0              # Quotes dropped from the graph by the ttl
+        self.solves = 0               # Solver runs
+        self.arbitrages = 0           # Arbitrage paths found
+        self.newestQuote = 0          # Publisher timestamp of the newest quote received, microseconds
+        self.decode = histogram()     # Decode time per datagram
+        self.graph = histogram()      # Graph build time per solve
+        self.solve = histogram()      # Solver time per solve
+        self.detection = histogram()  # Newest publisher timestamp to arbitrage found
+        self._flushed_at = time.monotonic()
+        self._flushed_quotes = 0
+
+    def datagram(self, quotes, seconds):
+        """
+        Method to count a received datagram and the time it took to decode
+        """
+        self.datagrams += 1
+        self.quotes += quotes
+        self.decode.add(seconds)
+
+    def detected(self):
+        """
+        Method to count an arbitrage found, timing it from the newest quote received
+        """
+        self.arbitrages += 1
+        if self.newestQuote:
+            self.detection.add(max(0.0, time.time() - self.newestQuote / 1000000))
+
+    def flush_due(self):
+        return self.path is not None and time.monotonic() - self._flushed_at >= self.period
+
+    def snapshot(self):
+        """
+        @return dictionary of all the metrics, the quote rate is over the time since the last write
+        """
+        elapsed = time.monotonic() - self._flushed_at
+        return {
+            'time': time.time(),
+            'quotes': self.quotes,
+            'datagrams': self.datagrams,
+            'quotes_per_s': (self.quotes - self._flushed_quotes) / elapsed if elapsed > 0 else None,
+            'out_of_sequence': self.outOfSequence,
+            'stale': self.stale,
+            'expired': self.expired,
+            'solves': self.solves,
+            'arbitrages': self.arbitrages,
+            'decode': self.decode.summary(),
+            'graph_build': self.graph.summary(),
+            'solve': self.solve.summary(),
+            'detection_latency': self.detection.summary(),
+        }
+
+    def write(self, extra=None):
+        """
+        Method to replace the metrics file with the current metrics
+        @param extra dictionary of more entries to write along
+        """
+        stats = self.snapshot()
+        stats.update(extra or {})
+        self._flushed_at = time.monotonic()
+        self._flushed_quotes = self.quotes
+        if self.path is None:
+            return stats
+        partial = self.path + '.tmp'
+        try:
+            with open(partial, 'w') as metrics:
+                json.dump(stats, metrics, indent=1)
+            os.replace(partial, self.path)  # Readers never see a half written file
+        except OSError as err:
+            print("Metrics Failure %s" % (err))
+        return stats
+
+
+class deferred_queue_handler(logging.handlers.QueueHandler):
+    """
+    QueueHandler which leaves the message formatting to the log sink thread
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def start_log_sink(level=logging.INFO, stream=None):
+    """
+    Function to route the LOGGER lines through a queue to a thread which formats and
+    writes them, so the hot path only pays for a level check, or a queue put when
+    the level is enabled. Calling it again only changes the level. Start worker
+    processes before it, a forked child gets the queue but not the thread
+    @param level lowest level written, per-quote lines are logged at DEBUG
+    @return the logger
+    """
+    global _sink, _sink_users
+    _sink_users += 1
+    logger = logging.getLogger(LOGGER)
+    logger.setLevel(level)
+    if _sink is None:
+        records = queue.SimpleQueue()
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(deferred_queue_handler(records))
+        logger.propagate = False
+        _sink = logging.handlers.QueueListener(records, handler)
+        _sink.start()
+    return logger
+
+
+def start_worker_log(level=logging.INFO, stream=None):
+    """
+    Function to set up the LOGGER in a worker process. Whatever it inherited from the
+    parent is dropped and the lines are written directly, the worker is off the hot path
+    @return the logger
+    """
+    global _sink, _sink_users
+    _sink, _sink_users = None, 0
+    logger = logging.getLogger(LOGGER)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.propagate = False
+    logger.setLevel(level)
+    return logger
+
+
+def stop_log_sink():
+    """
+    Function to write out the queued lines and stop the log sink thread, once every
+    start_log_sink call got its stop_log_sink
+    """
+    global _sink, _sink_users
+    _sink_users = max(0, _sink_users - 1)
+    if _sink is not None and not _sink_users:
+        _sink.stop()
+        logger = logging.getLogger(LOGGER)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        _sink = None
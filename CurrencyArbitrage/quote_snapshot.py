@@ -0,0 +1,190 @@
+"""
+@author: Aishwarya Supekar
+Seattle University
+"""
+import errno
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+SNAPSHOT_MAGIC = b'FXQS'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_CAPACITY = 64                        # Number of currencies a new snapshot file has room for
+SNAPSHOT_HEADER = struct.Struct('<4sIIIQ8x')  # Magic, version, capacity, currencies stored, write sequence
+CURRENCY_SIZE = 4                             # Bytes per currency table entry, 3 ascii letters and a pad byte
+READ_ATTEMPTS = 100                           # Reads of a snapshot being written before the reader gives up
+READ_BACKOFF = 0.01                           # Longest sleep in seconds between two of those reads
+
+
+class quote_snapshot(object):
+    """
+    Quotes kept in a memory-mapped file of fixed layout, so a restarted subscriber
+    starts with a warm graph and other local processes can read the live quotes:
+
+        header        SNAPSHOT_HEADER
+        currencies    capacity entries of CURRENCY_SIZE bytes, currency id -> name
+        timestamps    capacity x capacity native uint64, microseconds, 0 where there is no quote
+        rates         capacity x capacity native double, conversion rate of (from, to)
+
+    The write sequence is odd while a quote is being written, readers retry until
+    they read the same even sequence before and after. Only one writer may have the
+    file open, it holds an exclusive flock until close. A writer which died in the
+    middle of a quote leaves the sequence odd, the next writer makes it even again
+    """
+
+    def __init__(self, path, capacity=SNAPSHOT_CAPACITY, readonly=False):
+        """
+        @param path snapshot file, created by the writer if it does not exist
+        @param capacity number of currencies of a new file, an existing file keeps its own
+        @param readonly map the file read only, for processes other than the subscriber
+        @raises BlockingIOError if another writer has the file open
+        """
+        self.path = path
+        self.readonly = readonly
+        fd = os.open(path, os.O_RDONLY if readonly else os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if not readonly:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise BlockingIOError(errno.EWOULDBLOCK, "%s is written by another subscriber" % path) from None
+            capacity = self.check_header(fd, capacity)
+            if readonly:
+                self.map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            else:
+                self.map = mmap.mmap(fd, self.file_size(capacity))
+        except BaseException:
+            os.close(fd)
+            raise
+        if readonly:
+            os.close(fd)
+            fd = None
+        self.fd = fd                                   # Descriptor of the writer, it holds the lock
+        self.capacity = capacity
+        tableEnd = SNAPSHOT_HEADER.size + CURRENCY_SIZE * capacity
+        stampsEnd = tableEnd + 8 * capacity * capacity
+        view = memoryview(self.map)
+        self.count = view[12:16].cast('I')             # Number of currencies in the table
+        self.sequence = view[16:24].cast('Q')          # Write sequence
+        self.table = view[SNAPSHOT_HEADER.size:tableEnd]
+        self.timestamps = view[tableEnd:stampsEnd].cast('Q')
+        self.rates = view[stampsEnd:self.file_size(capacity)].cast('d')
+        self.currencies = []                           # Currency id -> name
+        self.currencyIds = {}                          # Currency name -> id
+        self.pairIds = {}                              # Currency pair bytes -> (from id, to id), None if no room
+        self.load_currencies()
+
+    def file_size(self, capacity):
+        """
+        Method to work out the size of a snapshot file
+        """
+        return SNAPSHOT_HEADER.size + CURRENCY_SIZE * capacity + 16 * capacity * capacity
+
+    def check_header(self, fd, capacity):
+        """
+        Method to validate an existing snapshot file, or lay out a new one for the writer.
+        The writer rounds an odd write sequence, left by a writer which died, up to even
+        @return capacity of the file
+        """
+        header = os.pread(fd, SNAPSHOT_HEADER.size, 0)
+        if len(header) == SNAPSHOT_HEADER.size:
+            magic, version, fileCapacity, count, sequence = SNAPSHOT_HEADER.unpack(header)
+            if magic == SNAPSHOT_MAGIC and version == SNAPSHOT_VERSION:
+                if os.fstat(fd).st_size >= self.file_size(fileCapacity):
+                    if sequence % 2 and not self.readonly:
+                        os.pwrite(fd, SNAPSHOT_HEADER.pack(magic, version, fileCapacity, count, sequence + 1), 0)
+                    return fileCapacity
+        if self.readonly:
+            raise ValueError("%s is not a quote snapshot" % self.path)
+        os.ftruncate(fd, 0)
+        os.ftruncate(fd, self.file_size(capacity))
+        os.pwrite(fd, SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, capacity, 0, 0), 0)
+        return capacity
+
+    def load_currencies(self):
+        """
+        Method to read the currency table, picking up currencies added by the writer
+        """
+        for currencyId in range(len(self.currencies), self.count[0]):
+            offset = currencyId * CURRENCY_SIZE
+            currency = bytes(self.table[offset:offset + 3]).decode('ascii')
+            self.currencyIds[currency] = currencyId
+            self.currencies.append(currency)
+
+    def currency_id(self, currency):
+        """
+        Method to intern a currency name in the file
+        @return id of the currency, None if the table is full
+        """
+        currencyId = self.currencyIds.get(currency)
+        if currencyId is None:
+            if len(self.currencies) == self.capacity:
+                return None
+            currencyId = len(self.currencies)
+            offset = currencyId * CURRENCY_SIZE
+            self.table[offset:offset + 3] = currency.encode('ascii')
+            self.currencyIds[currency] = currencyId
+            self.currencies.append(currency)
+            self.count[0] = len(self.currencies)
+        return currencyId
+
+    def record(self, microSeconds, pair, convRate):
+        """
+        Method to write one quote in place
+        @param pair currency pair as 6 ascii bytes
+        @return False if there is no room left for a new currency of the pair
+        """
+        ids = self.pairIds.get(pair, ())
+        if ids == ():
+            currencies = bytes(pair).decode('ascii')
+            cur1, cur2 = self.currency_id(currencies[0:3]), self.currency_id(currencies[3:6])
+            ids = self.pairIds[pair] = None if cur1 is None or cur2 is None else (cur1, cur2)
+        if ids is None:
+            return False
+        index = ids[0] * self.capacity + ids[1]
+        self.sequence[0] += 1
+        self.timestamps[index] = microSeconds
+        self.rates[index] = convRate
+        self.sequence[0] += 1
+        return True
+
+    def quotes(self, ttl=None, nowMicroSeconds=None):
+        """
+        Method to read every stored quote
+        @param ttl seconds, quotes older than that are left out, None for all of them
+        @param nowMicroSeconds current time in microseconds since the epoch, needed with ttl
+        @return list of (timestamp, currency pair as 6 ascii bytes, conversion rate)
+        @raises TimeoutError if no stable read was made in READ_ATTEMPTS, the writer may have died mid-write
+        """
+        oldest = 1 if ttl is None else max(1, nowMicroSeconds - ttl * 1000000)
+        for attempt in range(READ_ATTEMPTS):
+            if attempt:
+                time.sleep(min(READ_BACKOFF, 0.00001 * 2 ** attempt))
+            sequence = self.sequence[0]
+            if sequence % 2:
+                continue
+            self.load_currencies()
+            found = []
+            names = [currency.encode('ascii') for currency in self.currencies]
+            for cur1, name1 in enumerate(names):
+                row = cur1 * self.capacity
+                for cur2, name2 in enumerate(names):
+                    microSeconds = self.timestamps[row + cur2]
+                    if microSeconds >= oldest:
+                        found.append((microSeconds, name1 + name2, self.rates[row + cur2]))
+            if self.sequence[0] == sequence:
+                return found
+        raise TimeoutError("%s stayed in the middle of a write" % self.path)
+
+    def close(self):
+        """
+        Method to unmap the file, a writer also gives up its lock
+        """
+        for view in (self.count, self.sequence, self.table, self.timestamps, self.rates):
+            view.release()
+        self.map.close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
@@ -0,0 +1,193 @@
+"""
+@author: Aishwarya Supekar
+Seattle University
+"""
+import heapq
+import math
+from array import array
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed by weight_matrix
+    np = None
+
+INITIAL_CAPACITY = 32   # Number of currencies the arrays are first sized for
+
+
+class quote_store(object):
+    """
+    Live quotes of one subscriber. Every currency gets a small integer id the first
+    time it is seen and the quotes are kept in flat arrays indexed by (from, to).
+    With a ttl set, quotes older than ttl seconds are dropped by expire
+    """
+
+    def __init__(self, capacity=INITIAL_CAPACITY, ttl=None):
+        self.capacity = capacity
+        self.ttl = ttl                       # Quote time to live in seconds, None to keep quotes forever
+        self.expiry = []                     # Min-heap of (timestamp, from id, to id), one entry per stored quote
+        self.currencies = []                 # Currency id -> name
+        self.currencyIds = {}                # Currency name -> id
+        self.pairIds = {}                    # Currency pair bytes -> (from id, to id)
+        self.quoted = {}                     # (from id, to id) of every pair which has a quote, in arrival order
+        self.dirty = set()                   # (from id, to id) updated since the last take_changes
+        self.timestamps = array('Q', bytes(8 * capacity * capacity))  # 0 where there is no quote
+        self.weights = array('d', [math.inf]) * (capacity * capacity)  # Graph weight, inf where no edge
+
+    def currency_id(self, currency):
+        """
+        Method to intern a currency name
+        @return id of the currency
+        """
+        currencyId = self.currencyIds.get(currency)
+        if currencyId is None:
+            if len(self.currencies) == self.capacity:
+                self.grow(2 * self.capacity)
+            currencyId = self.currencyIds[currency] = len(self.currencies)
+            self.currencies.append(currency)
+        return currencyId
+
+    def pair_id(self, pair):
+        """
+        Method to look up the currency ids of a 6 byte pair code like b'USDGBP'
+        @return (from id, to id)
+        """
+        ids = self.pairIds.get(pair)
+        if ids is None:
+            currencies = bytes(pair).decode('ascii')
+            ids = self.pairIds[pair] = (self.currency_id(currencies[0:3]), self.currency_id(currencies[3:6]))
+        return ids
+
+    def pair_name(self, pair):
+        """
+        Method to get the printable name of a pair code, like 'USD GBP'
+        """
+        cur1, cur2 = self.pair_id(pair)
+        return self.currencies[cur1] + " " + self.currencies[cur2]
+
+    def grow(self, capacity):
+        """
+        Method to re-layout the arrays for a bigger number of currencies
+        """
+        timestamps = array('Q', bytes(8 * capacity * capacity))
+        weights = array('d', [math.inf]) * (capacity * capacity)
+        for row in range(len(self.currencies)):
+            old = row * self.capacity
+            new = row * capacity
+            timestamps[new:new + self.capacity] = self.timestamps[old:old + self.capacity]
+            weights[new:new + self.capacity] = self.weights[old:old + self.capacity]
+        self.capacity, self.timestamps, self.weights = capacity, timestamps, weights
+
+    def weight(self, currency1, currency2):
+        """
+        Method to look up the graph weight of an edge by currency names
+        @return log rate, inf if there is no quote for the edge
+        """
+        cur1 = self.currencyIds.get(currency1)
+        cur2 = self.currencyIds.get(currency2)
+        if cur1 is None or cur2 is None:
+            return math.inf
+        return self.weights[cur1 * self.capacity + cur2]
+
+    def has_quote(self, pair):
+        """
+        Method to check if a quote was ever stored for the pair
+        """
+        cur1, cur2 = self.pair_id(pair)
+        return self.timestamps[cur1 * self.capacity + cur2] != 0
+
+    def update(self, microSeconds, pair, convRate):
+        """
+        Method to store a quote unless a newer one for the same pair is already stored
+        @return True if the quote was stored, False if it was out of sequence
+        """
+        cur1, cur2 = self.pair_id(pair)
+        index = cur1 * self.capacity + cur2
+        old = self.timestamps[index]
+        if old >= microSeconds:
+            return False
+        weight = -math.log(convRate)
+        self.timestamps[index] = microSeconds
+        self.weights[index] = weight
+        self.weights[cur2 * self.capacity + cur1] = -weight
+        self.quoted[(cur1, cur2)] = None
+        self.dirty.add((cur1, cur2))
+        if self.ttl is not None:
+            heapq.heappush(self.expiry, (microSeconds, cur1, cur2))
+        return True
+
+    def expire(self, nowMicroSeconds):
+        """
+        Method to drop every quote older than the ttl. Heap entries of quotes which
+        were replaced by a newer one since are skipped
+        @param nowMicroSeconds current time in microseconds since the epoch
+        @return list of (from id, to id) of the dropped pairs
+        """
+        expired = []
+        if self.ttl is None:
+            return expired
+        oldest = nowMicroSeconds - self.ttl * 1000000
+        while self.expiry and self.expiry[0][0] < oldest:
+            microSeconds, cur1, cur2 = heapq.heappop(self.expiry)
+            index = cur1 * self.capacity + cur2
+            if self.timestamps[index] != microSeconds:
+                continue
+            reverse = cur2 * self.capacity + cur1
+            self.timestamps[index] = 0
+            if self.timestamps[reverse]:
+                self.weights[index] = -self.weights[reverse]  # still quoted the other way round
+            else:
+                self.weights[index] = math.inf
+                self.weights[reverse] = math.inf
+            del self.quoted[(cur1, cur2)]
+            self.dirty.add((cur1, cur2))
+            expired.append((cur1, cur2))
+        return expired
+
+    def graph(self):
+        """
+        Method to build the dict-of-dicts graph used by bellman_ford
+        @return graph
+        """
+        graph = defaultdict(dict)
+        for cur1, cur2 in self.quoted:
+            name1, name2 = self.currencies[cur1], self.currencies[cur2]
+            graph[name1][name2] = self.weights[cur1 * self.capacity + cur2]
+            graph[name2][name1] = self.weights[cur2 * self.capacity + cur1]
+        return graph
+
+    def quotes(self):
+        """
+        Method to read every stored quote back
+        @return list of (timestamp, currency pair as 6 ascii bytes, conversion rate)
+        """
+        found = []
+        for cur1, cur2 in self.quoted:
+            index = cur1 * self.capacity + cur2
+            pair = (self.currencies[cur1] + self.currencies[cur2]).encode('ascii')
+            found.append((self.timestamps[index], pair, math.exp(-self.weights[index])))
+        return found
+
+    def take_changes(self):
+        """
+        Method to collect the edges changed since the last call, for incremental_bellman_ford
+        @return dictionary of (currency1, currency2) -> log rate, inf for expired edges
+        """
+        changes = {}
+        for cur1, cur2 in self.dirty:
+            name1, name2 = self.currencies[cur1], self.currencies[cur2]
+            changes[(name1, name2)] = self.weights[cur1 * self.capacity + cur2]
+            changes[(name2, name1)] = self.weights[cur2 * self.capacity + cur1]
+        self.dirty.clear()
+        return changes
+
+    def weight_matrix(self):
+        """
+        Method to view the weights as a NumPy matrix without copying them
+        @return currencies, weights for bellman_ford.bellmanFordMatrix
+        """
+        if np is None:
+            raise ImportError("numpy is required for weight_matrix")
+        size = len(self.currencies)
+        weights = np.frombuffer(self.weights, dtype=np.float64).reshape(self.capacity, self.capacity)
+        return self.currencies, weights[:size, :size]
@@ -0,0 +1,144 @@
+"""
+@author: Aishwarya Supekar
+Seattle University
+"""
+import logging
+import multiprocessing
+import queue
+from arbitrage_finder import arbitrage_finder
+from metrics import start_worker_log
+
+SNAPSHOT_BACKLOG = 4    # Snapshots waiting for the solver before older ones get merged away
+CLOSE_TIMEOUT = 2.0     # Seconds the worker gets to stop on its own before it is terminated
+
+
+def run_solver(snapshots, results, engine, incremental, ttl, cache, logLevel):
+    """
+    Worker process loop. Applies every snapshot of quotes, solves, and sends back
+    (path, graph of the path) for every arbitrage found. A None snapshot stops it
+    """
+    start_worker_log(logLevel)
+    finder = arbitrage_finder(engine, incremental, ttl, cache)
+    while True:
+        snapshot = snapshots.get()
+        if snapshot is None:
+            break
+        for pair, (microSeconds, convRate) in snapshot.items():
+            finder.quotes.update(microSeconds, pair, convRate)
+        finder.expire_quotes()
+        path = finder.find_arbitrage()
+        if path:
+            results.send((path, finder.path_graph(path)))
+    results.close()
+
+
+class solver_process(object):
+    """
+    Runs an arbitrage_finder in a separate process, so the receive loop never waits
+    for a solve. Quotes go over a bounded queue of snapshots, results come back
+    over a pipe which can be registered with a selector. The pipe also becomes
+    readable when the worker dies, receive then finds it at EOF
+    """
+
+    def __init__(self, engine, incremental, ttl, cache, backlog=SNAPSHOT_BACKLOG, logLevel=logging.INFO):
+        """
+        @param logLevel level of the worker's log lines, which it writes itself
+        """
+        self.options = (engine, incremental, ttl, cache, logLevel)
+        self.backlog = backlog
+        self.submitted = 0      # Snapshots handed to the queue
+        self.dropped = 0        # Snapshots merged into a newer one because the solver fell behind
+        self.restarts = 0       # Workers started again after the previous one died
+        self.start()
+
+    def start(self):
+        """
+        Method to start a worker process with an empty queue and a new results pipe
+        """
+        self.snapshots = multiprocessing.Queue(self.backlog)
+        self.results, results = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=run_solver, daemon=True,
+                                               args=(self.snapshots, results) + self.options)
+        self.process.start()
+        results.close()
+        self.ended = False      # The results pipe reached EOF
+        self.held = None        # Snapshot which could not be queued yet, merged into the next one
+
+    def is_alive(self):
+        return not self.ended and self.process.is_alive()
+
+    def restart(self):
+        """
+        Method to replace a dead worker, the new one starts without any quotes. Unregister
+        the results pipe first, a new one takes its place
+        @return exit code of the worker replaced
+        """
+        self.close()
+        exitcode = self.process.exitcode
+        self.restarts += 1
+        self.start()
+        return exitcode
+
+    def submit(self, snapshot):
+        """
+        Method to queue a snapshot of quotes for the solver without ever blocking. When
+        the queue is full the oldest queued snapshot is taken back and merged into this
+        one; the newest timestamp rule of the quote store makes the merge order safe.
+        If no snapshot can be taken back right now (the worker is reading one) this one
+        is held and merged into the next
+        @param snapshot dictionary of pair bytes -> (timestamp, rate)
+        """
+        self.submitted += 1
+        if self.held is not None:
+            self.held.update(snapshot)
+            snapshot, self.held = self.held, None
+            self.dropped += 1
+        try:
+            self.snapshots.put_nowait(snapshot)
+            return
+        except queue.Full:
+            pass
+        try:
+            older = self.snapshots.get_nowait()
+        except queue.Empty:
+            self.held = snapshot
+            return
+        older.update(snapshot)
+        self.dropped += 1
+        try:
+            self.snapshots.put_nowait(older)
+        except queue.Full:
+            self.held = older
+
+    def receive(self):
+        """
+        Method to collect the results sent back so far
+        @return list of (path, graph of the path)
+        """
+        found = []
+        try:
+            while self.results.poll():
+                found.append(self.results.recv())
+        except EOFError:
+            self.ended = True   # The worker died, or stopped
+        return found
+
+    def close(self, timeout=CLOSE_TIMEOUT):
+        """
+        Method to stop the worker process, terminating it if it does not stop within the timeout
+        """
+        if self.is_alive():
+            try:
+                self.snapshots.put(None, timeout=timeout)
+                self.process.join(timeout)
+            except queue.Full:
+                pass
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+        if self.process.is_alive():  # A stopped process only takes SIGKILL
+            self.process.kill()
+            self.process.join()
+        self.snapshots.cancel_join_thread()  # Snapshots nobody reads any more must not hold up the exit
+        self.snapshots.close()
+        self.results.close()